@@ -1,4 +1,3 @@
-import asyncio
 import logging
 import settings
 from datetime import timedelta
@@ -16,12 +15,19 @@ from db.redis import get_redis_auth_pool
 from redis.asyncio import Redis
 from db.session import get_db
 from logger import log_connection
+from websocket.encoding import encode_frame
+from websocket.protocol import negotiate
+from websocket.protocol import receive_message
+from websocket.protocol import send_frame
 from .actions import _get_user_by_username_for_auth, authenticate_user
 from .actions import _get_user_by_email_for_auth
-from .dependencies import maintain_session, verify_token
+from .dependencies import verify_token
 from .dependencies import get_cookie_or_token
 from .dependencies import check_session
 from .security import create_access_token
+from .session_cache import AUTH_SESSION
+from .session_cache import session_cache
+from .session_watcher import session_watcher
 
 auth_router = APIRouter()
 
@@ -71,6 +77,7 @@ async def logout(response: Response, request: Request, redis: Redis = Depends(ge
     user_id = await verify_token(request, redis)
     if user_id:
         await redis.delete(f"user_id:{user_id}")
+        await session_cache.invalidate(AUTH_SESSION, user_id)
     response.delete_cookie("access_token")
     return {"message": "Вы вышли из аккаунта"}
 
@@ -88,26 +95,27 @@ async def websocket_endpoint(
         cookie_or_token: str = Depends(get_cookie_or_token),
         redis_auth: Redis = Depends(get_redis_auth_pool)
 ):
-    await websocket.accept()
+    await websocket.accept(subprotocol=negotiate(websocket))
     user_id, token_valid = await check_session(cookie_or_token, redis_auth)
     if not token_valid:
         logger.info("Invalid or expired token for WebSocket: token={}".format(cookie_or_token))
         await websocket.close(code=4001, reason="Недействительный токен")
         return
 
-    await websocket.send_json({"type": "AUTH_STATUS", "isAuthenticated": True})
+    await send_frame(websocket, encode_frame({"type": "AUTH_STATUS", "isAuthenticated": True}))
     log_connection(websocket, endpoint="auth", user_id=str(user_id), action="connected")
-    session_task = asyncio.create_task(maintain_session(websocket, cookie_or_token, redis_auth))
+    session_watcher.register(websocket, user_id, cookie_or_token)
 
     try:
         while True:
-            await websocket.receive_text()
+            await receive_message(websocket)
             _, token_valid = await check_session(cookie_or_token, redis_auth)
             if not token_valid:
                 await websocket.close(code=4001, reason="Токен устарел")
                 break
 
-            await websocket.send_json({"type": "message", "message": "Session is active"})
+            await send_frame(websocket, encode_frame({"type": "message", "message": "Session is active"}))
     except WebSocketDisconnect:
         log_connection(websocket, endpoint="auth", user_id=str(user_id), action="disconnected")
-        session_task.cancel()
+    finally:
+        session_watcher.unregister(websocket)
@@ -1,10 +1,8 @@
-import asyncio
-import json
 import logging
+import time
 import settings
 import jwt
 from jwt import ExpiredSignatureError
-from datetime import datetime
 from typing import Tuple
 from typing import Union
 from typing import Optional
@@ -16,10 +14,13 @@ from fastapi import HTTPException
 from fastapi import status
 from fastapi import Request
 from fastapi import WebSocketException
-from starlette.websockets import WebSocketState
 from fastapi.security import OAuth2PasswordBearer
 from redis.asyncio import Redis
+from db.redis import CHECK_SESSION_SCRIPT
+from db.redis import run_script
 from db.redis import get_redis_auth_pool
+from .session_cache import AUTH_SESSION
+from .session_cache import session_cache
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
@@ -33,6 +34,10 @@ async def verify_token(
     token = request.cookies.get("session")
     if not token:
         raise HTTPException(status_code=401, detail="Необходима авторизация.")
+    user_id = session_cache.get(AUTH_SESSION, token)
+    if user_id is not None:
+        return user_id
+    checked_at = time.time()
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         user_id = UUID(payload.get("sub"))
@@ -40,6 +45,7 @@ async def verify_token(
             raise HTTPException(
                 status_code=401, detail="Авторизация не удалась. Пожалуйста, авторизуйтесь заново."
             )
+        session_cache.put(AUTH_SESSION, token, user_id, payload["exp"], checked_at)
         return user_id
     except ExpiredSignatureError:
         logger.info("Token has expired")
@@ -52,6 +58,10 @@ async def verify_token(
 
 
 async def check_session(token: str, redis_auth: Redis) -> Tuple[Optional[UUID], bool]:
+    user_id = session_cache.get(AUTH_SESSION, token)
+    if user_id is not None:
+        return user_id, True
+    checked_at = time.time()
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         user_id = UUID(payload.get("sub"))
@@ -59,39 +69,18 @@ async def check_session(token: str, redis_auth: Redis) -> Tuple[Optional[UUID],
             return None, False
 
         user_key = f"user_id:{user_id}"
-        session_data = await redis_auth.get(user_key)
+        session_data = await run_script(
+            redis_auth, CHECK_SESSION_SCRIPT, keys=[user_key], args=[time.time()]
+        )
         if session_data is None:
             return None, False
-
-        session_info = json.loads(session_data)
-        expiration_time_str = session_info['exp']
-        expiration_time = datetime.strptime(expiration_time_str, "%Y-%m-%d %H:%M:%S").replace(
-            tzinfo=settings.ekb_timezone)
-        current_time = datetime.now(settings.ekb_timezone)
-
-        if current_time > expiration_time:
-            await redis_auth.delete(user_key)
-            return None, False
+        session_cache.put(AUTH_SESSION, token, user_id, payload["exp"], checked_at)
         return user_id, True
     except (jwt.PyJWTError, ValueError) as e:
         logger.info(f"Authentication error: {e}")
         return None, False
 
 
-async def maintain_session(websocket, token, redis_auth):
-    try:
-        while True:
-            await asyncio.sleep(10)  # 10 seconds
-            _, token_valid = await check_session(token, redis_auth)
-            if not token_valid:
-                await websocket.send_json({"type": "AUTH_STATUS", "isAuthenticated": False})
-                if websocket.application_state != WebSocketState.DISCONNECTED:
-                    await websocket.close(code=4001, reason="Connections refused.")
-                    break
-    except Exception as e:
-        logger.error("Error in maintain_session: %s", e)
-
-
 async def get_cookie_or_token(
     session: Union[str, None] = Cookie(default=None),
     token: Union[str, None] = Query(default=None),
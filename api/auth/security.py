@@ -6,6 +6,8 @@ from datetime import timedelta
 from typing import Optional
 from uuid import UUID
 from db.redis import get_redis_auth_pool
+from .session_cache import AUTH_SESSION
+from .session_cache import session_cache
 
 
 async def create_access_token(user_id: UUID, expires_delta: Optional[timedelta] = None):
@@ -25,10 +27,15 @@ async def create_access_token(user_id: UUID, expires_delta: Optional[timedelta]
     ttl = settings.ACCESS_TOKEN_EXPIRE_MINUTES * 60
     expiration_datetime_str = expires_delta.strftime("%Y-%m-%d %H:%M:%S")
     user_key = f"user_id:{user_id}"
-    await redis.delete(user_key)
-    await redis.setex(
-        f"user_id:{user_id}",
-        ttl,
-        json.dumps({"token": encoded_jwt, "user_id": str(user_id), "exp": expiration_datetime_str})
+    await redis.set(
+        user_key,
+        json.dumps({
+            "token": encoded_jwt,
+            "user_id": str(user_id),
+            "exp": expiration_datetime_str,
+            "exp_ts": expires_delta.timestamp(),
+        }),
+        ex=ttl,
     )
+    await session_cache.invalidate(AUTH_SESSION, user_id)
     return encoded_jwt
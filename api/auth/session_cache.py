@@ -0,0 +1,126 @@
+import asyncio
+import logging
+import time
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from uuid import UUID
+from redis.asyncio.client import PubSub
+from cache import TTLCache
+from db.redis import get_redis_auth_pool
+import settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Namespaces match the Redis key prefixes of the two kinds of sessions.
+AUTH_SESSION = "user_id"
+CHAT_SESSION = "chat_user_id"
+
+
+class SessionCache:
+    """Per-worker cache of tokens whose Redis session was already validated.
+
+    An entry lives for at most ``ttl`` seconds and never past the token's
+    own ``exp``. Logout and re-login call ``invalidate``, which drops the
+    user's entries here and, through a pub/sub channel, on every worker.
+    Entries remember when their Redis check started, so a check racing
+    with an invalidation cannot resurrect the session.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, channel: str):
+        self.ttl = ttl
+        self.channel = channel
+        self._entries = TTLCache(maxsize)
+        self._invalidated_at: Dict[Tuple[str, UUID], float] = {}
+        self._pubsub: Optional[PubSub] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._invalidation_listeners: List[Callable[[str, UUID], None]] = []
+        self._reset_listeners: List[Callable[[], None]] = []
+
+    def add_invalidation_listener(self, callback: Callable[[str, UUID], None]):
+        """Registers a callback run for every invalidation, local or broadcast."""
+        self._invalidation_listeners.append(callback)
+
+    def add_reset_listener(self, callback: Callable[[], None]):
+        """Registers a callback run when broadcast invalidations may have been lost."""
+        self._reset_listeners.append(callback)
+
+    def get(self, namespace: str, token: str) -> Optional[UUID]:
+        entry = self._entries.get((namespace, token))
+        if entry is None:
+            return None
+        user_id, checked_at = entry
+        if self._invalidated_at.get((namespace, user_id), 0.0) >= checked_at:
+            self._entries.pop((namespace, token))
+            return None
+        return user_id
+
+    def put(self, namespace: str, token: str, user_id: UUID, token_exp: float, checked_at: float):
+        self._entries.set((namespace, token), (user_id, checked_at), min(token_exp, checked_at + self.ttl))
+
+    def _invalidate_local(self, namespace: str, user_id: UUID):
+        now = time.time()
+        if len(self._invalidated_at) > self._entries.maxsize:
+            # Anything cached before now - ttl has expired anyway.
+            horizon = now - self.ttl
+            self._invalidated_at = {
+                key: when for key, when in self._invalidated_at.items() if when > horizon
+            }
+        self._invalidated_at[(namespace, user_id)] = now
+        for callback in self._invalidation_listeners:
+            callback(namespace, user_id)
+
+    async def invalidate(self, namespace: str, user_id: UUID):
+        self._invalidate_local(namespace, user_id)
+        redis = await get_redis_auth_pool()
+        await redis.publish(self.channel, f"{namespace} {user_id}")
+
+    async def start(self):
+        redis = await get_redis_auth_pool()
+        self._pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self.channel)
+        self._listener = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(self.channel)
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    async def _listen(self):
+        while True:
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+                if message is None:
+                    continue
+                namespace, user_id = message["data"].split(" ", 1)
+                self._invalidate_local(namespace, UUID(user_id))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Without invalidations the cache could serve revoked sessions.
+                logger.error("Error in session invalidation listener: %s", e)
+                self._entries.clear()
+                for callback in self._reset_listeners:
+                    callback()
+                await asyncio.sleep(1)
+
+    def stats(self) -> dict:
+        return self._entries.stats()
+
+
+session_cache = SessionCache(
+    maxsize=settings.SESSION_CACHE_SIZE,
+    ttl=settings.SESSION_CACHE_TTL,
+    channel=settings.SESSION_INVALIDATION_CHANNEL,
+)
@@ -0,0 +1,162 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from uuid import UUID
+import jwt
+from fastapi import WebSocket
+from starlette.websockets import WebSocketState
+from db.redis import get_redis_auth_pool
+from websocket.encoding import encode_frame
+from websocket.protocol import send_frame
+from .session_cache import AUTH_SESSION
+from .session_cache import session_cache
+import settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class SessionWatcher:
+    """Tracks the session expiry of every ``/auth/ws`` socket of a worker.
+
+    Expiries sit in one heap, so the watcher task sleeps until the next one
+    is due instead of each socket polling Redis. Logouts arrive through the
+    session cache invalidation channel; only the affected user's session is
+    then re-checked in Redis, and ``AUTH_STATUS`` is pushed to that user's
+    sockets alone. Because a lost pub/sub message must not extend a
+    session, every user is re-checked right after the invalidation
+    listener has failed, and as a backstop each ``reconcile_interval``
+    seconds. That sweep costs one pipelined EXISTS per connected user, so
+    the interval is minutes long: at 20k users a 30 second interval would
+    be about 670 commands a second for nothing.
+    """
+
+    def __init__(self, reconcile_interval: float):
+        self.reconcile_interval = reconcile_interval
+        self._next_reconcile = time.time() + reconcile_interval
+        self._heap: List[Tuple[float, int, WebSocket]] = []
+        self._counter = itertools.count()
+        self._sockets: Dict[WebSocket, Tuple[UUID, float]] = {}
+        self._sockets_by_user: Dict[UUID, Set[WebSocket]] = {}
+        self._recheck: Set[UUID] = set()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        session_cache.add_invalidation_listener(self._on_invalidated)
+        session_cache.add_reset_listener(self._recheck_everyone)
+
+    def register(self, websocket: WebSocket, user_id: UUID, token: str):
+        # check_session has already verified the token; only exp is needed here.
+        exp = jwt.decode(token, options={"verify_signature": False})["exp"]
+        self._sockets[websocket] = (user_id, exp)
+        self._sockets_by_user.setdefault(user_id, set()).add(websocket)
+        if not self._heap or exp < self._heap[0][0]:
+            self._wakeup.set()
+        heapq.heappush(self._heap, (exp, next(self._counter), websocket))
+
+    def unregister(self, websocket: WebSocket):
+        entry = self._sockets.pop(websocket, None)
+        if entry is None:
+            return
+        sockets = self._sockets_by_user.get(entry[0])
+        if sockets is not None:
+            sockets.discard(websocket)
+            if not sockets:
+                del self._sockets_by_user[entry[0]]
+        if len(self._heap) > 2 * len(self._sockets) + 64:
+            # Drop entries of closed sockets instead of waiting for their exp.
+            self._heap = [
+                (exp, next(self._counter), ws) for ws, (_, exp) in self._sockets.items()
+            ]
+            heapq.heapify(self._heap)
+
+    def _on_invalidated(self, namespace: str, user_id: UUID):
+        if namespace == AUTH_SESSION and user_id in self._sockets_by_user:
+            self._recheck.add(user_id)
+            self._wakeup.set()
+
+    def _recheck_everyone(self):
+        self._recheck.update(self._sockets_by_user)
+        self._wakeup.set()
+
+    async def start(self):
+        self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _watch(self):
+        while True:
+            try:
+                deadline = min(self._heap[0][0], self._next_reconcile) if self._heap else self._next_reconcile
+                timeout = max(deadline - time.time(), 0)
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+                if time.time() >= self._next_reconcile:
+                    self._next_reconcile = time.time() + self.reconcile_interval
+                    self._recheck.update(self._sockets_by_user)
+                await self._expire_due()
+                await self._recheck_users()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Error in session watcher: %s", e)
+                await asyncio.sleep(1)
+
+    async def _expire_due(self):
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            exp, _, websocket = heapq.heappop(self._heap)
+            entry = self._sockets.get(websocket)
+            if entry is not None and entry[1] == exp:
+                await self._revoke(websocket)
+
+    async def _recheck_users(self):
+        users, self._recheck = self._recheck, set()
+        if not users:
+            return
+        users = list(users)
+        redis = await get_redis_auth_pool()
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                for user_id in users:
+                    pipe.exists(f"user_id:{user_id}")
+                sessions = await pipe.execute()
+        except Exception:
+            # Try these users again on the next pass.
+            self._recheck.update(users)
+            raise
+        for user_id, exists in zip(users, sessions):
+            if not exists:
+                for websocket in list(self._sockets_by_user.get(user_id, ())):
+                    await self._revoke(websocket)
+
+    async def _revoke(self, websocket: WebSocket):
+        self.unregister(websocket)
+        try:
+            if websocket.application_state != WebSocketState.DISCONNECTED:
+                await send_frame(websocket, encode_frame({"type": "AUTH_STATUS", "isAuthenticated": False}))
+                await websocket.close(code=4001, reason="Connections refused.")
+        except Exception as e:
+            logger.info(f"Error revoking auth socket: {e}")
+
+    def stats(self) -> dict:
+        return {"sockets": len(self._sockets), "scheduled": len(self._heap)}
+
+
+session_watcher = SessionWatcher(settings.SESSION_RECONCILE_INTERVAL)
@@ -1,39 +1,181 @@
 import json
+from datetime import datetime
 from typing import List
+from typing import Optional
+from uuid import UUID
 from redis.asyncio import Redis
-from sqlalchemy.ext.asyncio import AsyncSession
-from db.models import Message
+from db.models import DEFAULT_ROOM
+from db.redis import run_script
+from db.session import async_session
+from settings import CHAT_MESSAGE_LOG
+from settings import MESSAGE_LOG_STREAM
 from settings import ekb_timezone
+from .dals import MessageDAL
+from .writer import MESSAGE_ID_KEY
+from .writer import message_id_floor
+from .writer import message_writer
+from .writer import note_message_id
+
+# One sorted set per room of its newest HISTORY_LIMIT messages, scored by
+# message id, or with CHAT_MESSAGE_LOG=stream one stream per room whose
+# entry ids are "<message id>-0". Ids come from one counter shared by all
+# rooms; each room also numbers its messages 1, 2, 3... so clients can spot
+# gaps and resume.
+HISTORY_KEY_PREFIX = "chat_history:"
+STREAM_KEY_PREFIX = "chat_stream:"
+SEQUENCE_KEY_PREFIX = "chat_seq:"
+HISTORY_LIMIT = 1000
+
+# Allocates the message id and the room sequence number, adds the message
+# and trims the history to the newest ARGV[2] entries in one round-trip.
+# ARGV[1] is the encoded message without its leading "{", so both numbers
+# can be spliced in front. The id counter is first raised to ARGV[3], the
+# highest id the calling worker knows to be taken.
+RAISE_ID_COUNTER = """
+if tonumber(redis.call('GET', KEYS[2]) or '0') < tonumber(ARGV[3]) then
+    redis.call('SET', KEYS[2], ARGV[3])
+end
+"""
+
+SAVE_MESSAGE_SCRIPT = RAISE_ID_COUNTER + """
+local id = redis.call('INCR', KEYS[2])
+local seq = redis.call('INCR', KEYS[3])
+redis.call('ZADD', KEYS[1], id, '{"id":' .. id .. ',"seq":' .. seq .. ',' .. ARGV[1])
+redis.call('ZREMRANGEBYRANK', KEYS[1], 0, -tonumber(ARGV[2]) - 1)
+return {id, seq}
+"""
+
+# The stream flavour: the room stream is capped approximately, which lets
+# Redis trim whole nodes, and the message is also appended to the log
+# stream (KEYS[4]) that the persister's consumer group drains.
+APPEND_MESSAGE_SCRIPT = RAISE_ID_COUNTER + """
+local id = redis.call('INCR', KEYS[2])
+local seq = redis.call('INCR', KEYS[3])
+local message = '{"id":' .. id .. ',"seq":' .. seq .. ',' .. ARGV[1]
+redis.call('XADD', KEYS[1], 'MAXLEN', '~', ARGV[2], id .. '-0', 'm', message)
+redis.call('XADD', KEYS[4], id .. '-0', 'm', message)
+return {id, seq}
+"""
+
+
+def history_key(room: str) -> str:
+    return f"{HISTORY_KEY_PREFIX}{room}"
+
+
+def stream_key(room: str) -> str:
+    return f"{STREAM_KEY_PREFIX}{room}"
+
+
+def sequence_key(room: str) -> str:
+    return f"{SEQUENCE_KEY_PREFIX}{room}"
 
 
 async def save_message(
     user_id: str,
     content: str,
     username: str,
-    db: AsyncSession,
     redis_pool_messages: Redis,
-):
-    new_message = Message(user_id=user_id, content=content)
-    db.add(new_message)
-    await db.commit()
-    await db.refresh(new_message)
-    created_at_with_tz = new_message.created_at.astimezone(ekb_timezone)
+    room: str = DEFAULT_ROOM,
+) -> dict:
+    """Caches the message right away; the row itself is written behind in
+    batches, from memory or from the log stream."""
+    created_at = datetime.now(ekb_timezone)
     message_data = {
-        "id": new_message.id,
+        "room": room,
         "user_id": str(user_id),
         "username": username,
         "content": content,
-        "created_at": created_at_with_tz.isoformat(),
+        "created_at": created_at.isoformat(),
     }
-    key = "chat_messages"
-    await redis_pool_messages.rpush(key, json.dumps(message_data, ensure_ascii=False))
-    await redis_pool_messages.ltrim(key, 0, 999)
+    encoded = json.dumps(message_data, ensure_ascii=False, separators=(",", ":"))
+    if CHAT_MESSAGE_LOG == "stream":
+        message_id, seq = await run_script(
+            redis_pool_messages,
+            APPEND_MESSAGE_SCRIPT,
+            keys=[stream_key(room), MESSAGE_ID_KEY, sequence_key(room), MESSAGE_LOG_STREAM],
+            args=[encoded[1:], HISTORY_LIMIT, message_id_floor()],
+        )
+    else:
+        await message_writer.reserve()
+        message_id, seq = await run_script(
+            redis_pool_messages,
+            SAVE_MESSAGE_SCRIPT,
+            keys=[history_key(room), MESSAGE_ID_KEY, sequence_key(room)],
+            args=[encoded[1:], HISTORY_LIMIT, message_id_floor()],
+        )
+        await message_writer.enqueue(message_id, room, UUID(str(user_id)), content, created_at)
+    note_message_id(message_id)
+    return {"id": message_id, "seq": seq, **message_data}
 
 
 async def get_messages(
-    redis_pool_messages: Redis, start: int = -20, count: int = 20
+    redis_pool_messages: Redis,
+    before_id: Optional[int] = None,
+    count: int = 20,
+    room: str = DEFAULT_ROOM,
 ) -> List[dict]:
-    key = "chat_messages"
-    end = start + count - 1
-    messages = await redis_pool_messages.lrange(key, start, end)
-    return [json.loads(message) for message in messages]
+    """Up to ``count`` messages of ``room`` older than ``before_id`` (the
+    newest ones when it is None), oldest first. Pages are served from the
+    room's Redis window and continue from the ``messages`` table once they
+    fall outside it."""
+    messages = await _get_cached_messages(redis_pool_messages, room, before_id, count)
+    if len(messages) < count:
+        oldest_id = messages[0]["id"] if messages else before_id
+        messages = await _get_messages_from_db(room, oldest_id, count - len(messages)) + messages
+    return messages
+
+
+async def get_messages_since(
+    redis_pool_messages: Redis, room: str, since: int, limit: int
+) -> Optional[List[dict]]:
+    """Messages of ``room`` with a sequence number above ``since``, oldest
+    first, or None when more than ``limit`` were missed or some of them
+    have already left the Redis window."""
+    latest = int(await redis_pool_messages.get(sequence_key(room)) or 0)
+    missed = latest - since
+    if missed == 0:
+        return []
+    if missed < 0 or missed > limit:
+        return None
+    # Read a little extra in case messages were added since the GET.
+    messages = await _get_cached_messages(redis_pool_messages, room, None, missed + 16)
+    messages = [message for message in messages if message.get("seq", 0) > since]
+    if not messages or messages[0]["seq"] != since + 1:
+        return None
+    return messages
+
+
+async def _get_cached_messages(
+    redis_pool_messages: Redis, room: str, before_id: Optional[int], count: int
+) -> List[dict]:
+    """Up to ``count`` messages of the room's Redis window older than
+    ``before_id``, oldest first."""
+    if CHAT_MESSAGE_LOG == "stream":
+        if before_id is not None and before_id <= 1:
+            return []
+        # An end id without a sequence part covers "<before_id - 1>-*".
+        max_id = "+" if before_id is None else str(before_id - 1)
+        entries = await redis_pool_messages.xrevrange(stream_key(room), max_id, "-", count=count)
+        cached = [fields["m"] for _, fields in entries]
+    else:
+        max_score = "+inf" if before_id is None else f"({before_id}"
+        cached = await redis_pool_messages.zrevrangebyscore(
+            history_key(room), max_score, "-inf", start=0, num=count
+        )
+    return [json.loads(message) for message in reversed(cached)]
+
+
+async def _get_messages_from_db(room: str, before_id: Optional[int], count: int) -> List[dict]:
+    async with async_session() as session:
+        rows = await MessageDAL(session).get_messages_before(room, before_id, count)
+    return [
+        {
+            "id": message_id,
+            "room": room,
+            "user_id": str(user_id),
+            "username": username,
+            "content": content,
+            "created_at": created_at.astimezone(ekb_timezone).isoformat(),
+        }
+        for message_id, user_id, username, content, created_at in reversed(rows)
+    ]
@@ -0,0 +1,31 @@
+from typing import List
+from typing import Optional
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from db.models import Message
+from db.models import User
+
+
+###########################################################
+# BLOCK FOR INTERACTION WITH DATABASE IN BUSINESS CONTEXT #
+###########################################################
+
+
+class MessageDAL:
+    def __init__(self, db_session: AsyncSession):
+        self.db_session = db_session
+
+    async def get_messages_before(self, room: str, before_id: Optional[int], limit: int) -> List[tuple]:
+        """Newest-first page of (id, user_id, username, content, created_at)
+        rows of ``room`` older than ``before_id``, walking the (room, id) index."""
+        query = (
+            select(Message.id, Message.user_id, User.username, Message.content, Message.created_at)
+            .join(User, User.user_id == Message.user_id)
+            .where(Message.room == room)
+            .order_by(Message.id.desc())
+            .limit(limit)
+        )
+        if before_id is not None:
+            query = query.where(Message.id < before_id)
+        res = await self.db_session.execute(query)
+        return list(res.all())
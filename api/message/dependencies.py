@@ -1,18 +1,25 @@
-import json
 import logging
+import time
 import settings
 import jwt
-from datetime import datetime
 from typing import Tuple
 from typing import Optional
 from uuid import UUID
 from redis.asyncio import Redis
+from db.redis import CHECK_SESSION_SCRIPT
+from db.redis import run_script
+from ..auth.session_cache import CHAT_SESSION
+from ..auth.session_cache import session_cache
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
 async def check_chat_session(token: str, redis_auth: Redis) -> Tuple[Optional[UUID], bool]:
+    user_id = session_cache.get(CHAT_SESSION, token)
+    if user_id is not None:
+        return user_id, True
+    checked_at = time.time()
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
         user_id = UUID(payload.get("sub"))
@@ -20,18 +27,12 @@ async def check_chat_session(token: str, redis_auth: Redis) -> Tuple[Optional[UU
             return None, False
 
         user_key = f"chat_user_id:{user_id}"
-        session_data = await redis_auth.get(user_key)
+        session_data = await run_script(
+            redis_auth, CHECK_SESSION_SCRIPT, keys=[user_key], args=[time.time()]
+        )
         if session_data is None:
             return None, False
-
-        session_info = json.loads(session_data)
-        expiration_time_str = session_info['exp']
-        expiration_time = datetime.strptime(expiration_time_str, "%Y-%m-%d %H:%M:%S").replace(
-            tzinfo=settings.ekb_timezone)
-        current_time = datetime.now(settings.ekb_timezone)
-        if current_time > expiration_time:
-            await redis_auth.delete(user_key)
-            return None, False
+        session_cache.put(CHAT_SESSION, token, user_id, payload["exp"], checked_at)
         return user_id, True
     except jwt.ExpiredSignatureError as e:
         logger.info(f"Token expired: {e}")
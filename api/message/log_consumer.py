@@ -0,0 +1,198 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+from datetime import datetime
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from uuid import UUID
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError
+from sqlalchemy.exc import DataError
+from sqlalchemy.exc import IntegrityError
+from db.redis import get_redis_messages_pool
+from .writer import _insert_messages
+from .writer import seed_message_id
+import settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+Entry = Tuple[str, Optional[dict]]
+
+DEAD_LETTER_MAXLEN = 10000
+
+
+class MessageLogConsumer:
+    """Persists chat messages from the log stream through a consumer group.
+
+    With ``CHAT_MESSAGE_LOG=stream`` every message is appended to ``stream``
+    on the send path. Each worker runs one consumer of ``group``, which
+    reads batches, writes each with one multi-row INSERT and then
+    acknowledges and deletes its entries, so the stream only holds what is
+    not in Postgres yet. Entries that were read but not acknowledged stay in
+    the group's pending list. A restarted consumer with the same name takes
+    its own back first, and entries of a consumer that is gone are claimed
+    by the others once they have been idle for ``claim_idle_ms`` (XPENDING
+    plus XCLAIM, which unlike XAUTOCLAIM work before Redis 6.2). Rows are
+    inserted with ON CONFLICT DO NOTHING, so writing a batch again after a
+    crash between the INSERT and the acknowledgement is harmless. A batch
+    Postgres rejects is retried row by row; entries that still fail, or
+    can not be parsed, are moved to ``dead_letter_stream`` and acknowledged
+    with the rest, so they can not hold the log back.
+    """
+
+    def __init__(
+        self,
+        stream: str,
+        group: str,
+        consumer: str,
+        batch_size: int,
+        block_ms: int,
+        claim_idle_ms: int,
+        dead_letter_stream: str,
+    ):
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self.dead_letter_stream = dead_letter_stream
+        self._task: Optional[asyncio.Task] = None
+        self._recovering = True
+        self._next_claim = 0.0
+
+    async def start(self):
+        await seed_message_id()
+        redis = await get_redis_messages_pool()
+        try:
+            await redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+        self._task = asyncio.create_task(self._consume_loop())
+
+    async def stop(self):
+        # A batch cut short stays pending and is picked up on the next start.
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _consume_loop(self):
+        while True:
+            try:
+                redis = await get_redis_messages_pool()
+                entries = await self._read(redis)
+                if entries:
+                    await self._persist(redis, entries)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error persisting chat messages from {self.stream}: {e}")
+                await asyncio.sleep(1)
+
+    async def _read(self, redis: Redis) -> List[Entry]:
+        if self._recovering:
+            # Entries this consumer read before it was restarted.
+            entries = await self._read_group(redis, "0")
+            if entries:
+                return entries
+            self._recovering = False
+        now = asyncio.get_running_loop().time()
+        if now >= self._next_claim:
+            self._next_claim = now + self.claim_idle_ms / 1000
+            if await self._claim_idle(redis):
+                # Claimed entries join our own pending list; read them from there.
+                self._recovering = True
+                return []
+        return await self._read_group(redis, ">", self.block_ms)
+
+    async def _claim_idle(self, redis: Redis) -> int:
+        pending = await redis.xpending_range(
+            self.stream, self.group, min="-", max="+", count=self.batch_size
+        )
+        idle_ids = [
+            entry["message_id"] for entry in pending
+            if entry["consumer"] != self.consumer and entry["time_since_delivered"] >= self.claim_idle_ms
+        ]
+        if not idle_ids:
+            return 0
+        # XCLAIM checks the idle time again, so entries another consumer
+        # has just taken over stay with it.
+        claimed = await redis.xclaim(
+            self.stream, self.group, self.consumer, self.claim_idle_ms, idle_ids, justid=True
+        )
+        if claimed:
+            logger.info(f"Claimed {len(claimed)} chat messages left pending by another consumer")
+        return len(claimed)
+
+    async def _read_group(self, redis: Redis, last_id: str, block: Optional[int] = None) -> List[Entry]:
+        response = await redis.xreadgroup(
+            self.group, self.consumer, {self.stream: last_id}, count=self.batch_size, block=block
+        )
+        return response[0][1] if response else []
+
+    async def _persist(self, redis: Redis, entries: List[Entry]):
+        rows: Dict[str, dict] = {}
+        rejected: List[Tuple[str, dict, str]] = []
+        for entry_id, fields in entries:
+            # Pending entries deleted from the stream come back without fields.
+            if not fields:
+                continue
+            try:
+                rows[entry_id] = _message_row(json.loads(fields["m"]))
+            except (KeyError, TypeError, ValueError) as e:
+                rejected.append((entry_id, fields, f"unreadable entry: {e!r}"))
+        if rows:
+            try:
+                await _insert_messages(list(rows.values()))
+            except (IntegrityError, DataError) as e:
+                logger.warning(f"Batch of {len(rows)} chat messages rejected, retrying row by row: {e}")
+                fields_by_id = dict(entries)
+                for entry_id, row in rows.items():
+                    try:
+                        await _insert_messages([row])
+                    except (IntegrityError, DataError) as row_error:
+                        rejected.append((entry_id, fields_by_id[entry_id], str(row_error)))
+        entry_ids = [entry_id for entry_id, _ in entries]
+        async with redis.pipeline(transaction=True) as pipe:
+            for entry_id, fields, error in rejected:
+                logger.error(f"Moving chat log entry {entry_id} to {self.dead_letter_stream}: {error}")
+                pipe.xadd(
+                    self.dead_letter_stream,
+                    {**fields, "entry_id": entry_id, "error": error},
+                    maxlen=DEAD_LETTER_MAXLEN,
+                    approximate=True,
+                )
+            pipe.xack(self.stream, self.group, *entry_ids)
+            pipe.xdel(self.stream, *entry_ids)
+            await pipe.execute()
+
+
+def _message_row(message: dict) -> dict:
+    return {
+        "id": message["id"],
+        "room": message["room"],
+        "user_id": UUID(message["user_id"]),
+        "content": message["content"],
+        "created_at": datetime.fromisoformat(message["created_at"]),
+    }
+
+
+message_log_consumer = MessageLogConsumer(
+    stream=settings.MESSAGE_LOG_STREAM,
+    group=settings.MESSAGE_LOG_GROUP,
+    consumer=settings.MESSAGE_LOG_CONSUMER or f"{socket.gethostname()}-{os.getpid()}",
+    batch_size=settings.MESSAGE_FLUSH_BATCH_SIZE,
+    block_ms=settings.MESSAGE_LOG_BLOCK_MS,
+    claim_idle_ms=settings.MESSAGE_LOG_CLAIM_IDLE_MS,
+    dead_letter_stream=settings.MESSAGE_LOG_DEAD_LETTER_STREAM,
+)
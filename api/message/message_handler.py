@@ -5,12 +5,12 @@ from fastapi import WebSocketDisconnect
 from fastapi import Depends
 from fastapi import status
 from fastapi.responses import JSONResponse
-from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
 from redis.asyncio import Redis
 from websocket.action import handle_websocket_connect
 from websocket.action import handle_messages
 from websocket.action import handle_websocket_disconnect
-from db.session import get_db
+from db.session import async_session
 from db.redis import get_redis_chat_auth_pool
 from db.redis import get_redis_messages_pool
 from .dependencies import check_chat_session
@@ -35,9 +35,9 @@ async def websocket_endpoint(
         *,
         websocket: WebSocket,
         token: str = Query(default=None, alias="chat_token"),
+        since: Optional[int] = Query(default=None),
         redis_auth: Redis = Depends(get_redis_chat_auth_pool),
         redis_messages: Redis = Depends(get_redis_messages_pool),
-        session: AsyncSession = Depends(get_db)
 ):
     user = None
     user_id, token_valid = await check_chat_session(token, redis_auth)
@@ -47,7 +47,10 @@ async def websocket_endpoint(
 
     try:
         while True:
-            user = await _get_user_by_id(session=session, user_id=user_id)
+            # No request-scoped session here: it would pin a pooled
+            # connection for the whole life of the socket.
+            async with async_session() as session:
+                user = await _get_user_by_id(session=session, user_id=user_id)
             if not user:
                 await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
                 return
@@ -56,9 +59,13 @@ async def websocket_endpoint(
                 await websocket.close(code=4001, reason="Токен устарел")
                 break
 
-            await handle_websocket_connect(user, websocket, session, redis_messages)
+            await handle_websocket_connect(user, websocket, redis_messages, since)
             log_connection(websocket, endpoint="messages", user_id=str(user_id), action="connected")
-            await handle_messages(websocket, user, session, redis_messages)
+            await handle_messages(websocket, user, redis_messages)
     except WebSocketDisconnect:
         log_connection(websocket, endpoint="messages", user_id=str(user_id), action="disconnected")
-        await handle_websocket_disconnect(user, websocket, session)
+    finally:
+        # Any other error must not leave the socket's outbox, writer task,
+        # room memberships and presence behind.
+        if user is not None:
+            await handle_websocket_disconnect(user, websocket)
@@ -6,6 +6,8 @@ from datetime import timedelta
 from typing import Optional
 from uuid import UUID
 from db.redis import get_redis_chat_auth_pool
+from ..auth.session_cache import CHAT_SESSION
+from ..auth.session_cache import session_cache
 
 
 async def create_chat_token(user_id: UUID, username: str, expires_delta: Optional[timedelta] = None):
@@ -25,16 +27,17 @@ async def create_chat_token(user_id: UUID, username: str, expires_delta: Optiona
     ttl = settings.CHAT_TOKEN_EXPIRE_MINUTES * 60
     expiration_datetime_str = expire.strftime("%Y-%m-%d %H:%M:%S")
     user_key = f"chat_user_id:{user_id}"
-    await redis.delete(user_key)
-    await redis.setex(
-        f"chat_user_id:{user_id}",
-        ttl,
+    await redis.set(
+        user_key,
         json.dumps({
             "token": encoded_jwt,
             "user_id": str(user_id),
             "username": str(username),
-            "exp": expiration_datetime_str
-        })
+            "exp": expiration_datetime_str,
+            "exp_ts": expire.timestamp(),
+        }),
+        ex=ttl,
     )
 
+    await session_cache.invalidate(CHAT_SESSION, user_id)
     return encoded_jwt
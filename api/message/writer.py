@@ -0,0 +1,220 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import List
+from typing import Optional
+from uuid import UUID
+from sqlalchemy import func
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.exc import DataError
+from sqlalchemy.exc import IntegrityError
+from db.models import Message
+from db.redis import get_redis_messages_pool
+from db.redis import run_script
+from db.session import background_session
+import settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+MESSAGE_ID_KEY = "chat_message_id"
+
+# The highest message id this process has seen taken, in Postgres or handed
+# out by the counter. The save scripts never let the counter drop below it,
+# so a Redis that lost the counter or came back from an older snapshot does
+# not reissue ids this worker already used.
+_id_floor = 0
+
+# Raises the id counter to at least ARGV[1], never lowers it.
+SEED_ID_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+if current < tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[1], ARGV[1])
+end
+return redis.call('GET', KEYS[1])
+"""
+
+
+async def seed_message_id():
+    """Makes sure new ids continue after the newest persisted message."""
+    async with background_session() as session:
+        max_id = (await session.execute(select(func.coalesce(func.max(Message.id), 0)))).scalar()
+    note_message_id(max_id)
+    redis = await get_redis_messages_pool()
+    await run_script(redis, SEED_ID_SCRIPT, keys=[MESSAGE_ID_KEY], args=[_id_floor])
+
+
+def message_id_floor() -> int:
+    return _id_floor
+
+
+def note_message_id(message_id: int):
+    global _id_floor
+    _id_floor = max(_id_floor, message_id)
+
+
+class MessageBacklogFull(Exception):
+    """The database is down or behind and ``max_pending`` messages wait."""
+
+
+class MessageWriter:
+    """Write-behind persistence of chat messages.
+
+    Messages get their id (from the Redis counter under ``MESSAGE_ID_KEY``)
+    and timestamp on the send path and are buffered in memory; a background
+    task writes them to the ``messages`` table with one multi-row INSERT per
+    batch, either when ``batch_size`` rows are pending or every
+    ``flush_interval`` seconds.
+    Whatever is still buffered is flushed on shutdown.
+
+    A batch the database rejects is retried row by row, and rows it still
+    rejects are logged and dropped, so one bad row can not hold back the
+    rows behind it. Any other error keeps the batch for the next flush;
+    inserts skip ids that are already stored, so retrying is safe. At most
+    ``max_pending`` messages are buffered: past that ``reserve`` tries a
+    flush and raises ``MessageBacklogFull`` if it does not make room, so
+    senders get an error instead of the buffer growing while the database
+    is down.
+    """
+
+    def __init__(self, batch_size: int, flush_interval: float, max_pending: int):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._pending: List[dict] = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        await seed_message_id()
+        self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        while self._pending:
+            if not await self.flush():
+                logger.error(f"Lost {len(self._pending)} unflushed chat messages on shutdown")
+                break
+
+    async def reserve(self):
+        """Call before saving a message; raises while the buffer is full."""
+        if len(self._pending) < self.max_pending:
+            return
+        # The database is falling behind: make the sender wait for a flush.
+        await self.flush()
+        if len(self._pending) >= self.max_pending:
+            raise MessageBacklogFull(f"{len(self._pending)} chat messages are waiting for the database")
+
+    async def enqueue(self, message_id: int, room: str, user_id: UUID, content: str, created_at: datetime):
+        self._pending.append({
+            "id": message_id,
+            "room": room,
+            "user_id": user_id,
+            "content": content,
+            "created_at": created_at,
+        })
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> bool:
+        async with self._flush_lock:
+            if not self._pending:
+                return True
+            batch = self._pending[:self.batch_size]
+            try:
+                try:
+                    await _insert_messages(batch)
+                except (IntegrityError, DataError) as e:
+                    logger.warning(f"Batch of {len(batch)} chat messages rejected, retrying row by row: {e}")
+                    for row in batch:
+                        await _insert_or_drop(row)
+            except Exception as e:
+                logger.error(f"Failed to flush {len(batch)} chat messages: {e}")
+                return False
+            del self._pending[:len(batch)]
+            if len(self._pending) >= self.batch_size:
+                self._wakeup.set()
+            return True
+
+
+async def _insert_messages(rows: List[dict]):
+    """Inserts the rows, skipping ones that are already stored.
+
+    A skipped id that belongs to a different message means the counter
+    went backwards and handed it out twice; such a message is stored under
+    a fresh id after the counter is reseeded past the table, instead of
+    being lost. Its copy in the Redis history keeps the old id.
+    """
+    async with background_session() as session:
+        async with session.begin():
+            while rows:
+                inserted = set(await session.scalars(
+                    insert(Message)
+                    .on_conflict_do_nothing(index_elements=[Message.id])
+                    .returning(Message.id),
+                    rows,
+                ))
+                skipped = [row for row in rows if row["id"] not in inserted]
+                rows = await _reassign_ids(session, skipped) if skipped else []
+
+
+async def _reassign_ids(session, skipped: List[dict]) -> List[dict]:
+    """The skipped rows whose id is taken by another message, with new ids."""
+    stored = {
+        message.id: message
+        for message in await session.scalars(
+            select(Message).where(Message.id.in_([row["id"] for row in skipped]))
+        )
+    }
+    collided = [
+        row for row in skipped
+        if row["id"] not in stored
+        or (stored[row["id"]].user_id, stored[row["id"]].content) != (row["user_id"], row["content"])
+    ]
+    if not collided:
+        return []
+    max_id = (await session.execute(select(func.coalesce(func.max(Message.id), 0)))).scalar()
+    note_message_id(max_id)
+    redis = await get_redis_messages_pool()
+    await run_script(redis, SEED_ID_SCRIPT, keys=[MESSAGE_ID_KEY], args=[_id_floor])
+    reassigned = []
+    for row in collided:
+        message_id = await redis.incr(MESSAGE_ID_KEY)
+        note_message_id(message_id)
+        logger.error(f"Chat message id {row['id']} was issued twice, storing the second message as {message_id}")
+        reassigned.append({**row, "id": message_id})
+    return reassigned
+
+
+async def _insert_or_drop(row: dict) -> bool:
+    """Inserts one message; drops it if the database rejects the row itself."""
+    try:
+        await _insert_messages([row])
+    except (IntegrityError, DataError) as e:
+        logger.error(f"Dropping chat message {row['id']} that can not be stored ({row!r}): {e}")
+        return False
+    return True
+
+
+message_writer = MessageWriter(
+    batch_size=settings.MESSAGE_FLUSH_BATCH_SIZE,
+    flush_interval=settings.MESSAGE_FLUSH_INTERVAL_MS / 1000,
+    max_pending=settings.MESSAGE_MAX_PENDING,
+)
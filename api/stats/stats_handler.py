@@ -0,0 +1,52 @@
+from fastapi import APIRouter
+from api.auth.session_cache import session_cache
+from api.auth.session_watcher import session_watcher
+from api.user.cache import user_cache
+from db.redis import get_redis_pool_stats
+from db.session import get_db_pool_stats
+from hashing import get_hasher_stats
+from smtp.mail_queue import get_email_stats
+from websocket.action import manager
+
+stats_router = APIRouter()
+
+
+@stats_router.get("/pools")
+async def get_pool_stats() -> dict:
+    return {"redis": get_redis_pool_stats(), "database": get_db_pool_stats()}
+
+
+@stats_router.get("/connection-budget")
+async def get_connection_budget() -> dict:
+    """Open WebSockets against the database connections they hold."""
+    database = get_db_pool_stats()["api"]
+    chat_sockets = len(manager.active_connections)
+    auth_sockets = session_watcher.stats()["sockets"]
+    return {
+        "sockets": {"chat": chat_sockets, "auth": auth_sockets},
+        "database": {"in_use": database["in_use"], "pool_size": database["pool_size"]},
+        "db_connections_per_socket": round(
+            database["in_use"] / max(chat_sockets + auth_sockets, 1), 3
+        ),
+    }
+
+
+@stats_router.get("/hasher")
+async def get_hasher_pool_stats() -> dict:
+    return get_hasher_stats()
+
+
+@stats_router.get("/email")
+async def get_email_queue_stats() -> dict:
+    return await get_email_stats()
+
+
+@stats_router.get("/caches")
+async def get_cache_stats() -> dict:
+    return {
+        "sessions": session_cache.stats(),
+        "session_watcher": session_watcher.stats(),
+        "users": user_cache.stats(),
+        "presence": manager.presence.stats(),
+        "chat": manager.stats(),
+    }
@@ -0,0 +1,125 @@
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+from uuid import UUID
+from sqlalchemy.ext.asyncio import AsyncSession
+from cache import TTLCache
+from db.models import User
+from ..auth.session_cache import session_cache
+from .dals import UserDAL
+import settings
+
+# Invalidations travel over the session cache channel under this namespace.
+USER_RECORD = "user_record"
+
+LOOKUP_FIELDS = ("user_id", "username", "email")
+
+
+@dataclass(frozen=True)
+class UserSnapshot:
+    """Detached, immutable copy of a ``users`` row."""
+
+    user_id: UUID
+    username: str
+    email: str
+    hashed_password: str
+    is_active: bool
+    activation_time: Optional[datetime]
+
+    @classmethod
+    def from_model(cls, user: User) -> "UserSnapshot":
+        return cls(
+            user_id=user.user_id,
+            username=user.username,
+            email=user.email,
+            hashed_password=user.hashed_password,
+            is_active=bool(user.is_active),
+            activation_time=user.activation_time,
+        )
+
+
+class UserCache:
+    """Per-worker read-through cache of user rows by id, username and email.
+
+    Misses are cached too, for a shorter time, so floods of logins with
+    unknown usernames stop at the cache. ``invalidate`` drops a user on
+    every worker and forgets all cached misses, since the change may have
+    created the user they refer to.
+    """
+
+    def __init__(self, maxsize: int, ttl: float, negative_ttl: float):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self._entries = TTLCache(maxsize)
+        self._invalidated_at: Dict[UUID, float] = {}
+        self._misses_cleared_at = 0.0
+        session_cache.add_invalidation_listener(self._on_invalidated)
+
+    def get(self, field: str, value) -> Tuple[bool, Optional[UserSnapshot]]:
+        """Returns ``(found, snapshot)``; a cached miss is ``(True, None)``."""
+        entry = self._entries.get((field, value))
+        if entry is None:
+            return False, None
+        snapshot, fetched_at = entry
+        if snapshot is None:
+            stale = fetched_at <= self._misses_cleared_at
+        else:
+            stale = fetched_at <= self._invalidated_at.get(snapshot.user_id, 0.0)
+        if stale:
+            self._entries.pop((field, value))
+            return False, None
+        return True, snapshot
+
+    def put(self, field: str, value, user: Optional[User], fetched_at: float) -> Optional[UserSnapshot]:
+        if user is None:
+            self._entries.set((field, value), (None, fetched_at), fetched_at + self.negative_ttl)
+            return None
+        snapshot = UserSnapshot.from_model(user)
+        for lookup_field in LOOKUP_FIELDS:
+            self._entries.set(
+                (lookup_field, getattr(snapshot, lookup_field)), (snapshot, fetched_at), fetched_at + self.ttl
+            )
+        return snapshot
+
+    def _on_invalidated(self, namespace: str, user_id: UUID):
+        if namespace != USER_RECORD:
+            return
+        now = time.time()
+        if len(self._invalidated_at) > self._entries.maxsize:
+            horizon = now - self.ttl
+            self._invalidated_at = {
+                key: when for key, when in self._invalidated_at.items() if when > horizon
+            }
+        self._invalidated_at[user_id] = now
+        self._misses_cleared_at = now
+
+    async def invalidate(self, user_id: UUID):
+        await session_cache.invalidate(USER_RECORD, user_id)
+
+    async def load(self, field: str, value, session: AsyncSession) -> Optional[UserSnapshot]:
+        found, snapshot = self.get(field, value)
+        if found:
+            return snapshot
+        fetched_at = time.time()
+        async with session.begin():
+            user_dal = UserDAL(session)
+            if field == "user_id":
+                user = await user_dal.get_user_by_id(value)
+            elif field == "username":
+                user = await user_dal.get_user_by_username(value)
+            else:
+                user = await user_dal.get_user_by_email(value)
+            return self.put(field, value, user, fetched_at)
+
+    def stats(self) -> dict:
+        return self._entries.stats()
+
+
+user_cache = UserCache(
+    maxsize=settings.USER_CACHE_SIZE,
+    ttl=settings.USER_CACHE_TTL,
+    negative_ttl=settings.USER_NEGATIVE_CACHE_TTL,
+)
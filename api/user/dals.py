@@ -5,6 +5,8 @@ from typing import Optional
 from uuid import UUID
 from sqlalchemy import ColumnElement, select
 from sqlalchemy import and_
+from sqlalchemy import delete
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from db.models import User
 from db.models import ActivationCode
@@ -79,6 +81,27 @@ class ActivationCodeDAL:
         await self.db_session.flush()  
         return activation_record
     
+    async def insert_activation_code(
+        self, code: str, email: str, username: str, hashed_password: str
+    ) -> Optional[int]:
+        """Inserts the code unless it is already taken. Returns the new id,
+        or None on a collision, without aborting the transaction."""
+        query = (
+            insert(ActivationCode)
+            .values(
+                code=code,
+                email=email,
+                username=username,
+                hashed_password=hashed_password,
+                created_at=datetime.now(settings.ekb_timezone),
+                status=ActivationStatus.PENDING,
+            )
+            .on_conflict_do_nothing(index_elements=[ActivationCode.code])
+            .returning(ActivationCode.id)
+        )
+        res = await self.db_session.execute(query)
+        return res.scalar_one_or_none()
+
     async def delete_activation_code(self, activation_record: ActivationCode):
         await self.db_session.delete(activation_record)
         await self.db_session.commit()
@@ -89,6 +112,14 @@ class ActivationCodeDAL:
         res = await self.db_session.execute(query)
         return res.scalars().first()
 
+    async def delete_expired_pending_codes(self, expired_before: datetime) -> int:
+        query = delete(ActivationCode).where(
+            ActivationCode.status == ActivationStatus.PENDING,
+            ActivationCode.created_at < expired_before,
+        )
+        res = await self.db_session.execute(query)
+        return res.rowcount
+
     async def update_activation_status(self, activation_record: ActivationCode, status: ActivationStatus):
         activation_record.status = status
         await self.db_session.commit()
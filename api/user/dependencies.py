@@ -1,5 +1,7 @@
+import time
 import jwt
 import settings
+from uuid import UUID
 from fastapi import Depends
 from fastapi import Cookie
 from fastapi import HTTPException
@@ -7,6 +9,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from redis.asyncio import Redis
 from db.redis import get_redis_auth_pool
 from db.session import get_db
+from ..auth.session_cache import AUTH_SESSION
+from ..auth.session_cache import session_cache
 from .actions import _get_user_by_id
 
 
@@ -17,16 +21,20 @@ async def get_current_user(
 ):
     credentials_exception = HTTPException(status_code=401, detail="Необходима авторизация.")
     try:
-        payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
-        user_id: str = payload.get("sub")
-        session_active = await redis.exists(f"user_id:{user_id}")
-        if not session_active:
-            raise HTTPException(status_code=401, detail="Сессия истекла. Пожалуйста, авторизуйтесь заново.")
+        user_id = session_cache.get(AUTH_SESSION, token)
+        if user_id is None:
+            checked_at = time.time()
+            payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[settings.ALGORITHM])
+            user_id = UUID(payload.get("sub"))
+            session_active = await redis.exists(f"user_id:{user_id}")
+            if not session_active:
+                raise HTTPException(status_code=401, detail="Сессия истекла. Пожалуйста, авторизуйтесь заново.")
+            session_cache.put(AUTH_SESSION, token, user_id, payload["exp"], checked_at)
 
         user = await _get_user_by_id(session=session, user_id=user_id)
         if user is None:
             raise credentials_exception
 
         return user
-    except jwt.PyJWTError:
+    except (jwt.PyJWTError, ValueError, TypeError):
         raise HTTPException(status_code=403, detail="Необходима авторизация.")
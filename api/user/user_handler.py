@@ -11,7 +11,8 @@ from api.schemas import ShowUser
 from api.schemas import UserCreate
 from api.schemas import ActivationCodeData
 from .dependencies import get_current_user
-from .actions import _create_new_activation_code, _create_new_user
+from .actions import ActivationCodesExhausted
+from .actions import _create_new_activation_code
 from .actions import _activate_user_account
 
 user_router = APIRouter()
@@ -19,8 +20,13 @@ user_router = APIRouter()
 
 @user_router.post("/", response_model=ShowUser)
 async def create_user(body: UserCreate, db: AsyncSession = Depends(get_db)) -> ShowUser:
-    result = await _create_new_activation_code(body, db)
-    
+    try:
+        result = await _create_new_activation_code(body, db)
+    except ActivationCodesExhausted:
+        raise HTTPException(
+            status_code=503, detail="Не удалось создать код активации. Попробуйте еще раз позже."
+        )
+
     if result == "email_exists":
         raise HTTPException(status_code=400, detail="Пользователь с таким email уже существует.")
     elif result == "username_exists":
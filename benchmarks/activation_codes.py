@@ -0,0 +1,100 @@
+"""Database round-trips per activation code allocation at 10%, 50% and 90%
+occupancy of the 6-digit code space.
+
+Simulates the table with an in-memory set, so it needs neither Postgres
+nor Redis. ``probe loop`` is the old SELECT-until-free loop followed by
+the INSERT. ``counter`` is the keyed permutation of a counter followed by
+INSERT ... ON CONFLICT DO NOTHING (plus one Redis INCR per attempt,
+not counted here), measured both on a table filled by the
+counter itself (steady state) and on one filled by random legacy codes
+(the worst case right after switching over). Like the real signup it gives
+up after ACTIVATION_CODE_MAX_ATTEMPTS inserts, which fails the signup with
+a 500; ``failed`` is the share of signups that ran out of attempts.
+
+The counter needs exactly one attempt only while the live codes are the
+ones it issued itself in its current cycle. On a table filled with random
+codes, or after the counter is reset or wraps onto codes that are still
+live, collisions are as likely as in the probe loop, and at high occupancy
+many signups fail.
+
+    python -m benchmarks.activation_codes [--signups 2000]
+"""
+import argparse
+import random
+import statistics
+from typing import List
+from typing import Tuple
+from api.user.actions import ACTIVATION_CODE_MAX_ATTEMPTS
+from smtp.activate_account import CODE_SPACE
+from smtp.activate_account import scramble_code_index
+
+OCCUPANCIES = (0.1, 0.5, 0.9)
+
+
+def probe_loop(taken: set) -> int:
+    round_trips = 0
+    while True:
+        round_trips += 1  # SELECT ... WHERE code = :code
+        code = random.randrange(CODE_SPACE)
+        if code not in taken:
+            taken.add(code)
+            return round_trips + 1  # INSERT
+
+
+def counter(taken: set, state: dict) -> Tuple[int, bool]:
+    """Round-trips of one allocation and whether it found a free code."""
+    for attempt in range(1, ACTIVATION_CODE_MAX_ATTEMPTS + 1):
+        state["counter"] = (state["counter"] + 1) % CODE_SPACE
+        code = scramble_code_index(state["counter"])
+        # INSERT ... ON CONFLICT DO NOTHING RETURNING id
+        if code not in taken:
+            taken.add(code)
+            return attempt, True
+    return ACTIVATION_CODE_MAX_ATTEMPTS, False
+
+
+def fill_randomly(occupancy: float) -> set:
+    return set(random.sample(range(CODE_SPACE), int(CODE_SPACE * occupancy)))
+
+
+def fill_by_counter(occupancy: float, state: dict) -> set:
+    count = int(CODE_SPACE * occupancy)
+    state["counter"] = count
+    return {scramble_code_index(index) for index in range(1, count + 1)}
+
+
+def summarize(samples: List[int]) -> str:
+    return f"mean {statistics.mean(samples):>5.2f}  max {max(samples):>3}"
+
+
+def summarize_capped(results: List[Tuple[int, bool]]) -> str:
+    failed = sum(1 for _, ok in results if not ok) / len(results)
+    return f"{summarize([round_trips for round_trips, _ in results])}  failed {failed:>6.1%}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--signups", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'occupancy':>9}  {'probe loop':>20}  {'counter':>34}  {'counter (legacy fill)':>34}")
+    for occupancy in OCCUPANCIES:
+        taken = fill_randomly(occupancy)
+        old = [probe_loop(taken) for _ in range(args.signups)]
+
+        state = {}
+        taken = fill_by_counter(occupancy, state)
+        new = [counter(taken, state) for _ in range(args.signups)]
+
+        state = {"counter": 0}
+        taken = fill_randomly(occupancy)
+        legacy = [counter(taken, state) for _ in range(args.signups)]
+
+        print(
+            f"{occupancy:>9.0%}  {summarize(old):>20}  "
+            f"{summarize_capped(new):>34}  {summarize_capped(legacy):>34}"
+        )
+
+
+if __name__ == "__main__":
+    main()
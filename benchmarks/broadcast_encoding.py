@@ -0,0 +1,70 @@
+"""Per-message CPU cost of a chat broadcast against room size.
+
+Compares the old per-recipient ``json.dumps`` loop with encoding the frame
+once, using the stdlib encoder and orjson (when installed).
+
+    python -m benchmarks.broadcast_encoding [--messages 2000]
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+from websocket import encoding
+
+ROOM_SIZES = (1, 10, 100, 1000)
+
+
+def _message() -> dict:
+    return {
+        "username": "пользователь",
+        "content": "Привет всем! Как дела? " * 4,
+        "created_at": datetime.now().isoformat(),
+        "type": "broadcast_message",
+    }
+
+
+def per_recipient(message: dict, outboxes: list):
+    for outbox in outboxes:
+        outbox.append(json.dumps(message, ensure_ascii=False))
+
+
+def encode_once_with(encoder):
+    def fan_out(message: dict, outboxes: list):
+        frame = encoder(message)
+        for outbox in outboxes:
+            outbox.append(frame)
+    return fan_out
+
+
+def run(strategy, room_size: int, messages: int) -> float:
+    outboxes = [[] for _ in range(room_size)]
+    message = _message()
+    started = time.process_time()
+    for _ in range(messages):
+        strategy(message, outboxes)
+        for outbox in outboxes:
+            outbox.clear()
+    return (time.process_time() - started) / messages * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--messages", type=int, default=2000)
+    args = parser.parse_args()
+
+    strategies = {
+        "per-recipient json": per_recipient,
+        "encode-once json": encode_once_with(encoding._encode_stdlib),
+    }
+    if encoding.orjson is not None:
+        strategies["encode-once orjson"] = encode_once_with(encoding._encode_orjson)
+
+    print(f"{'room size':>10} " + " ".join(f"{name:>20}" for name in strategies))
+    for room_size in ROOM_SIZES:
+        messages = max(args.messages // room_size, 20)
+        costs = [run(strategy, room_size, messages) for strategy in strategies.values()]
+        print(f"{room_size:>10} " + " ".join(f"{cost:>17.1f} us" for cost in costs))
+
+
+if __name__ == "__main__":
+    main()
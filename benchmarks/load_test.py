@@ -0,0 +1,467 @@
+"""Load test of signup, login and chat against a local stack.
+
+Starts the app with uvicorn (unless --url points at a running one) using
+the Postgres and redis-server from .env, with SMTP redirected to a sink
+in this process that captures activation codes. Run it against scratch
+databases: every run creates users and chat messages.
+
+Scenarios, in order:
+
+- signup: POST /user/, wait for the activation email, POST /user/activate
+- login: bursts of POST /auth/token for the accounts just created
+- chat: --clients sockets on /messages/ws sending messages, typing and
+  paging history for --duration seconds
+
+Reports count, throughput and p50/p95/p99 per operation and writes them
+as JSON (--output) so results can be compared between releases.
+
+    python -m benchmarks.load_test [--clients 50] [--duration 30] [--output results.json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from collections import defaultdict
+from datetime import datetime
+from datetime import timezone
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from urllib.parse import urlencode
+from urllib.parse import urlsplit
+import websockets
+
+PASSWORD = "load-test-password"
+CODE_PATTERN = re.compile(rb"activation code is (\d+)")
+# Chat message bodies carry their send time so receivers can time delivery.
+MESSAGE_PREFIX = "lt|"
+
+
+class Recorder:
+    """Collects latency samples and error counts per operation."""
+
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Counter = Counter()
+        self.elapsed: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float):
+        self.samples[name].append(seconds)
+
+    def error(self, name: str):
+        self.errors[name] += 1
+
+    def summary(self) -> Dict[str, dict]:
+        result = {}
+        for name in sorted(set(self.samples) | set(self.errors)):
+            samples = sorted(self.samples[name])
+            elapsed = self.elapsed.get(name.split(".")[0]) or 1.0
+            result[name] = {
+                "count": len(samples),
+                "errors": self.errors[name],
+                "throughput": round(len(samples) / elapsed, 2),
+                "mean_ms": _ms(sum(samples) / len(samples)) if samples else None,
+                "p50_ms": _ms(percentile(samples, 0.50)),
+                "p95_ms": _ms(percentile(samples, 0.95)),
+                "p99_ms": _ms(percentile(samples, 0.99)),
+                "max_ms": _ms(samples[-1]) if samples else None,
+            }
+        return result
+
+
+def percentile(samples: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile of already sorted samples."""
+    if not samples:
+        return None
+    return samples[min(len(samples) - 1, max(0, round(fraction * len(samples)) - 1))]
+
+
+def _ms(seconds: Optional[float]) -> Optional[float]:
+    return None if seconds is None else round(seconds * 1000, 3)
+
+
+async def http_request(
+    base_url: str, method: str, path: str, body: bytes = b"", headers: Optional[dict] = None
+) -> Tuple[int, Dict[str, List[str]], bytes]:
+    """One HTTP/1.1 request on a fresh connection, read until close."""
+    url = urlsplit(base_url)
+    reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+    try:
+        lines = [
+            f"{method} {path} HTTP/1.1",
+            f"Host: {url.netloc}",
+            "Connection: close",
+            f"Content-Length: {len(body)}",
+        ]
+        lines.extend(f"{name}: {value}" for name, value in (headers or {}).items())
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode() + body)
+        await writer.drain()
+        raw = await reader.read()
+    finally:
+        writer.close()
+    head, _, payload = raw.partition(b"\r\n\r\n")
+    head_lines = head.decode("latin-1").split("\r\n")
+    response_headers = defaultdict(list)
+    for line in head_lines[1:]:
+        name, _, value = line.partition(":")
+        response_headers[name.strip().lower()].append(value.strip())
+    return int(head_lines[0].split()[1]), response_headers, payload
+
+
+def session_cookie(headers: Dict[str, List[str]]) -> Optional[str]:
+    for cookie in headers.get("set-cookie", []):
+        name, _, rest = cookie.partition("=")
+        if name == "session":
+            return rest.split(";", 1)[0]
+    return None
+
+
+class SmtpSink:
+    """Just enough of an SMTP server for smtplib; keeps activation codes."""
+
+    def __init__(self):
+        self._codes: Dict[str, asyncio.Future] = {}
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def _future(self, email: str) -> asyncio.Future:
+        if email not in self._codes:
+            self._codes[email] = asyncio.get_running_loop().create_future()
+        return self._codes[email]
+
+    async def start(self, port: int):
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def wait_for_code(self, email: str, timeout: float) -> str:
+        return await asyncio.wait_for(self._future(email), timeout)
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        writer.write(b"220 load-test ESMTP\r\n")
+        recipient = None
+        try:
+            while line := await reader.readline():
+                command = line[:4].upper()
+                if command in (b"EHLO", b"HELO"):
+                    writer.write(b"250 load-test\r\n")
+                elif command == b"RCPT":
+                    recipient = line.split(b"<", 1)[1].split(b">", 1)[0].decode().lower()
+                    writer.write(b"250 OK\r\n")
+                elif command == b"DATA":
+                    writer.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+                    await writer.drain()
+                    data = await reader.readuntil(b"\r\n.\r\n")
+                    match = CODE_PATTERN.search(data)
+                    if recipient and match:
+                        future = self._future(recipient)
+                        if not future.done():
+                            future.set_result(match.group(1).decode())
+                    writer.write(b"250 OK\r\n")
+                elif command == b"QUIT":
+                    writer.write(b"221 Bye\r\n")
+                    break
+                else:
+                    writer.write(b"250 OK\r\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_app(port: int, smtp_port: int, workers: int) -> Tuple[subprocess.Popen, str]:
+    """Runs uvicorn with .env, except that mail goes to the sink."""
+    overrides = {
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(smtp_port),
+        "SMTP_USE_SSL": "false",
+        "SMTP_USER": "",
+        "SMTP_PASSWORD": "",
+    }
+    if workers > 1:
+        overrides["CHAT_DISTRIBUTED"] = "true"
+    lines = []
+    if os.path.exists(".env"):
+        with open(".env") as env_file:
+            lines = [line for line in env_file if line.split("=", 1)[0].strip() not in overrides]
+    lines.extend(f"{name}={value}\n" for name, value in overrides.items())
+    fd, env_path = tempfile.mkstemp(suffix=".env")
+    with os.fdopen(fd, "w") as env_file:
+        env_file.writelines(lines)
+    process = subprocess.Popen(
+        [
+            sys.executable, "-m", "uvicorn", "main:app",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(workers), "--log-level", "warning",
+        ],
+        env={**os.environ, "ENV_FILE": env_path},
+    )
+    return process, env_path
+
+
+async def wait_until_ready(base_url: str, timeout: float):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            status, _, _ = await http_request(base_url, "GET", "/stats/pools")
+            if status == 200:
+                return
+        except OSError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError(f"App at {base_url} did not come up within {timeout}s")
+        await asyncio.sleep(0.5)
+
+
+async def run_signups(
+    base_url: str, sink: SmtpSink, recorder: Recorder, count: int, concurrency: int, run_id: str
+) -> List[str]:
+    """Creates and activates ``count`` accounts; returns their usernames."""
+    semaphore = asyncio.Semaphore(concurrency)
+    usernames = []
+
+    async def signup(index: int):
+        username = f"lt{run_id}_{index}"
+        email = f"{username}@example.com"
+        body = json.dumps({"username": username, "email": email, "password": PASSWORD}).encode()
+        async with semaphore:
+            started = time.perf_counter()
+            status, _, _ = await http_request(
+                base_url, "POST", "/user/", body, {"Content-Type": "application/json"}
+            )
+            if status != 200:
+                recorder.error("signup")
+                return
+            sent = time.perf_counter()
+            recorder.add("signup", sent - started)
+        try:
+            code = await sink.wait_for_code(email, timeout=60)
+        except asyncio.TimeoutError:
+            recorder.error("signup.activation_email")
+            return
+        recorder.add("signup.activation_email", time.perf_counter() - sent)
+        async with semaphore:
+            started = time.perf_counter()
+            status, _, _ = await http_request(
+                base_url, "POST", "/user/activate", json.dumps({"code": code}).encode(),
+                {"Content-Type": "application/json"},
+            )
+            if status != 200:
+                recorder.error("signup.activate")
+                return
+            recorder.add("signup.activate", time.perf_counter() - started)
+        usernames.append(username)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(signup(index) for index in range(count)))
+    recorder.elapsed["signup"] = time.perf_counter() - started
+    return usernames
+
+
+async def run_logins(
+    base_url: str, recorder: Recorder, usernames: List[str], count: int, concurrency: int
+) -> Dict[str, str]:
+    """Fires ``count`` logins in bursts of ``concurrency``; returns a session
+    cookie per username."""
+    semaphore = asyncio.Semaphore(concurrency)
+    cookies = {}
+
+    async def login(username: str):
+        body = urlencode({"username": username, "password": PASSWORD}).encode()
+        async with semaphore:
+            started = time.perf_counter()
+            status, headers, _ = await http_request(
+                base_url, "POST", "/auth/token", body,
+                {"Content-Type": "application/x-www-form-urlencoded"},
+            )
+            cookie = session_cookie(headers)
+            if status != 200 or cookie is None:
+                recorder.error("login")
+                return
+            recorder.add("login", time.perf_counter() - started)
+            cookies[username] = cookie
+
+    started = time.perf_counter()
+    await asyncio.gather(*(login(usernames[index % len(usernames)]) for index in range(count)))
+    recorder.elapsed["login"] = time.perf_counter() - started
+    return cookies
+
+
+async def chat_client(
+    base_url: str, recorder: Recorder, cookie: str, index: int, deadline: float, message_interval: float
+):
+    status, _, body = await http_request(
+        base_url, "GET", "/messages/request-chat-token", headers={"Cookie": f"session={cookie}"}
+    )
+    if status != 200:
+        recorder.error("chat.token")
+        return
+    chat_token = json.loads(body)["chat_token"]
+    ws_url = base_url.replace("http", "ws", 1) + f"/messages/ws?chat_token={chat_token}"
+
+    started = time.perf_counter()
+    async with websockets.connect(ws_url, max_size=None) as websocket:
+        while json.loads(await websocket.recv())["type"] != "initial_load":
+            pass
+        recorder.add("chat.initial_load", time.perf_counter() - started)
+
+        sent_at: Dict[int, float] = {}
+        page_requested: List[float] = []
+
+        async def receive():
+            async for raw in websocket:
+                frame = json.loads(raw)
+                frame_type = frame.get("type")
+                if frame_type == "broadcast_message" and frame["content"].startswith(MESSAGE_PREFIX):
+                    recorder.add("chat.delivery", time.time() - float(frame["content"].split("|")[1]))
+                elif frame_type == "new_message" and frame["content"].startswith(MESSAGE_PREFIX):
+                    sequence = int(frame["content"].split("|")[3])
+                    if sequence in sent_at:
+                        recorder.add("chat.ack", time.perf_counter() - sent_at.pop(sequence))
+                elif frame_type == "more_messages" and page_requested:
+                    recorder.add("chat.history_page", time.perf_counter() - page_requested.pop(0))
+
+        async def send():
+            sequence = 0
+            while time.monotonic() < deadline:
+                await websocket.send(json.dumps({"action": "typing"}))
+                await asyncio.sleep(random.uniform(0, message_interval / 2))
+                sequence += 1
+                sent_at[sequence] = time.perf_counter()
+                content = f"{MESSAGE_PREFIX}{time.time():.6f}|{index}|{sequence}"
+                await websocket.send(json.dumps({"action": "send_message", "content": content}))
+                await websocket.send(json.dumps({"action": "stop_typing"}))
+                if sequence % 10 == 0:
+                    page_requested.append(time.perf_counter())
+                    await websocket.send(json.dumps({"action": "load_more_messages"}))
+                await asyncio.sleep(random.uniform(message_interval / 2, message_interval))
+            # Give the last messages time to arrive everywhere.
+            await asyncio.sleep(1)
+
+        receiver = asyncio.create_task(receive())
+        try:
+            await send()
+        finally:
+            receiver.cancel()
+
+
+async def run_chat(
+    base_url: str, recorder: Recorder, cookies: List[str], clients: int, duration: float, message_rate: float
+):
+    deadline = time.monotonic() + duration
+    started = time.perf_counter()
+    results = await asyncio.gather(
+        *(
+            chat_client(base_url, recorder, cookies[index % len(cookies)], index, deadline, 1 / message_rate)
+            for index in range(clients)
+        ),
+        return_exceptions=True,
+    )
+    for result in results:
+        if isinstance(result, Exception):
+            recorder.error("chat.client")
+            print(f"chat client failed: {result!r}", file=sys.stderr)
+    recorder.elapsed["chat"] = time.perf_counter() - started
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_table(summary: Dict[str, dict]):
+    """Human-readable summary on stderr, keeping stdout for the JSON report."""
+    print(
+        f"{'operation':<26}{'count':>8}{'err':>6}{'per s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}",
+        file=sys.stderr,
+    )
+    for name, row in summary.items():
+        cells = [row["p50_ms"], row["p95_ms"], row["p99_ms"]]
+        latencies = "".join(f"{cell:>10.1f}" if cell is not None else f"{'-':>10}" for cell in cells)
+        print(
+            f"{name:<26}{row['count']:>8}{row['errors']:>6}{row['throughput']:>10.1f}{latencies}",
+            file=sys.stderr,
+        )
+
+
+async def run(args) -> dict:
+    recorder = Recorder()
+    sink = SmtpSink()
+    await sink.start(args.smtp_port)
+    process = env_path = None
+    base_url = args.url
+    if base_url is None:
+        port = free_port()
+        process, env_path = start_app(port, args.smtp_port, args.workers)
+        base_url = f"http://127.0.0.1:{port}"
+    try:
+        await wait_until_ready(base_url, timeout=60)
+        run_id = f"{int(time.time())}{random.randrange(1000):03}"
+        usernames = await run_signups(base_url, sink, recorder, args.signups, args.concurrency, run_id)
+        if not usernames:
+            raise RuntimeError("No account could be created; is SMTP pointed at the sink?")
+        cookies = await run_logins(base_url, recorder, usernames, args.logins, args.concurrency)
+        if not cookies:
+            raise RuntimeError("No login succeeded")
+        await run_chat(base_url, recorder, list(cookies.values()), args.clients, args.duration, args.message_rate)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+            os.unlink(env_path)
+        await sink.stop()
+    return {
+        "started_at": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "results": recorder.summary(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", help="test a running app instead of starting one")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers of the started app")
+    parser.add_argument(
+        "--smtp-port", type=int, default=8025, help="SMTP sink port; with --url, point the app's SMTP here"
+    )
+    parser.add_argument("--signups", type=int, default=20)
+    parser.add_argument("--logins", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--message-rate", type=float, default=1.0, help="messages per second per client")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_table(report["results"])
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
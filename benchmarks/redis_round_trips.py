@@ -0,0 +1,74 @@
+"""Counts Redis round-trips per login, per chat-token request and per message.
+
+Needs a scratch redis-server at REDIS_URL: the message scenario appends
+to the chat history there. Every packet written to a Redis
+connection is one round-trip (a pipeline or a script call is one packet).
+
+    python -m benchmarks.redis_round_trips [--iterations 100]
+"""
+import argparse
+import asyncio
+import time
+from uuid import uuid4
+from redis.asyncio.connection import Connection
+from api.auth.dependencies import check_session
+from api.auth.security import create_access_token
+from api.message.actions import save_message
+from api.message.dependencies import check_chat_session
+from api.message.security import create_chat_token
+from db.redis import close_redis_pools
+from db.redis import get_redis_auth_pool
+from db.redis import get_redis_chat_auth_pool
+from db.redis import get_redis_messages_pool
+from db.redis import init_redis_pools
+
+round_trips = 0
+_send_packed_command = Connection.send_packed_command
+
+
+async def _counting_send_packed_command(self, command, check_health=True):
+    global round_trips
+    round_trips += 1
+    return await _send_packed_command(self, command, check_health)
+
+
+async def measure(name: str, operation, iterations: int):
+    global round_trips
+    await operation()  # loads scripts and warms up the pool
+    round_trips = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        await operation()
+    elapsed = time.perf_counter() - started
+    print(
+        f"{name:<16} {round_trips / iterations:>6.2f} round-trips/op "
+        f"{elapsed / iterations * 1e6:>10.1f} us/op"
+    )
+
+
+async def main(iterations: int):
+    Connection.send_packed_command = _counting_send_packed_command
+    await init_redis_pools()
+    user_id = uuid4()
+    redis_auth = await get_redis_auth_pool()
+    redis_chat_auth = await get_redis_chat_auth_pool()
+    redis_messages = await get_redis_messages_pool()
+    token = await create_access_token(user_id)
+    chat_token = await create_chat_token(user_id, "bench")
+
+    await measure("login", lambda: create_access_token(user_id), iterations)
+    await measure("chat token", lambda: create_chat_token(user_id, "bench"), iterations)
+    await measure("check session", lambda: check_session(token, redis_auth), iterations)
+    await measure("check chat", lambda: check_chat_session(chat_token, redis_chat_auth), iterations)
+    await measure(
+        "message",
+        lambda: save_message(str(user_id), "benchmark", "bench", redis_messages),
+        iterations,
+    )
+    await close_redis_pools()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=100)
+    asyncio.run(main(parser.parse_args().iterations))
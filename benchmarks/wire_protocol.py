@@ -0,0 +1,125 @@
+"""Bytes on the wire and CPU per frame of the negotiable WebSocket protocols.
+
+Sends a stream of typical chat frames through each combination of JSON or
+MessagePack (when installed) with or without permessage-deflate. Deflate
+keeps its context between frames like the websockets server does, so later
+frames profit from the earlier ones. Sizes include the WebSocket frame
+header; CPU covers everything after the shared JSON encode: the MessagePack
+conversion and compression.
+
+    python -m benchmarks.wire_protocol [--frames 2000]
+"""
+import argparse
+import random
+import time
+import zlib
+from datetime import datetime
+from typing import Callable
+from typing import Dict
+from typing import List
+from websocket import protocol
+from websocket.encoding import encode_frame
+
+
+WORDS = (
+    "привет", "всем", "как", "дела", "сегодня", "встреча", "в", "пять", "кто",
+    "будет", "ок", "отлично", "спасибо", "посмотрю", "позже", "ссылка", "на",
+    "документ", "hello", "deploy", "готов", "ревью", "баг", "исправил",
+)
+
+
+def _message(message_id: int) -> dict:
+    rng = random.Random(message_id)
+    return {
+        "id": message_id,
+        "seq": message_id,
+        "username": f"пользователь{rng.randrange(50)}",
+        "content": " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 25))),
+        "created_at": datetime.now().isoformat(),
+    }
+
+
+def _frames(count: int) -> Dict[str, List[str]]:
+    return {
+        "broadcast_message": [
+            encode_frame({"type": "broadcast_message", "room": "general", **_message(i)})
+            for i in range(count)
+        ],
+        "initial_load": [
+            encode_frame({
+                "type": "initial_load",
+                "room": "general",
+                "messages": [_message(i * 20 + j) for j in range(20)],
+            })
+            for i in range(max(count // 20, 1))
+        ],
+        "typing_users": [
+            encode_frame({
+                "type": "typing_users",
+                "room": "general",
+                "started": [f"пользователь{i % 7}"],
+                "stopped": [],
+            })
+            for i in range(count)
+        ],
+    }
+
+
+def _header_size(length: int) -> int:
+    # Server frames are unmasked.
+    if length < 126:
+        return 2
+    return 4 if length < 65536 else 10
+
+
+def _deflate() -> Callable[[bytes], bytes]:
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+
+    def compress(data: bytes) -> bytes:
+        # permessage-deflate drops the empty block that ends a sync flush.
+        return (compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]
+    return compress
+
+
+def _to_json(frame: str) -> bytes:
+    return frame.encode()
+
+
+def _to_msgpack(frame: str) -> bytes:
+    return protocol._to_msgpack.__wrapped__(frame)
+
+
+def run(frames: List[str], encode: Callable[[str], bytes], deflate: bool):
+    compress = _deflate() if deflate else None
+    total = 0
+    started = time.process_time()
+    for frame in frames:
+        payload = encode(frame)
+        if compress is not None:
+            payload = compress(payload)
+        total += len(payload) + _header_size(len(payload))
+    elapsed = time.process_time() - started
+    return total / len(frames), elapsed / len(frames) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=2000)
+    args = parser.parse_args()
+
+    variants = {"json": (_to_json, False), "json+deflate": (_to_json, True)}
+    if protocol.msgpack is not None:
+        variants["msgpack"] = (_to_msgpack, False)
+        variants["msgpack+deflate"] = (_to_msgpack, True)
+    else:
+        print("msgpack is not installed, only JSON is measured")
+
+    print(f"{'frame':>18} {'protocol':>16} {'bytes':>10} {'cpu':>10}")
+    for name, frames in _frames(args.frames).items():
+        for variant, (encode, deflate) in variants.items():
+            size, cost = run(frames, encode, deflate)
+            print(f"{name:>18} {variant:>16} {size:>10.1f} {cost:>7.1f} us")
+
+
+if __name__ == "__main__":
+    main()
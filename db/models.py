@@ -7,6 +7,7 @@ from sqlalchemy import Integer
 from sqlalchemy import ForeignKey
 from sqlalchemy import DateTime
 from sqlalchemy import func
+from sqlalchemy import Index
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import relationship
 
@@ -43,7 +44,7 @@ class ActivationCode(Base):
     username = Column(String, nullable=True)  
     hashed_password = Column(String, nullable=True)  
     code = Column(String, nullable=False, unique=True)
-    created_at = Column(DateTime(timezone=True), default=func.now())
+    created_at = Column(DateTime(timezone=True), default=func.now(), index=True)
     status = Column(String, nullable=False, default='pending')
 
 
@@ -71,10 +72,17 @@ class ConnectionHistory(Base):
     user = relationship("User", back_populates="connection_history")
 
 
+# Room of every message written before rooms existed.
+DEFAULT_ROOM = "general"
+
+
 class Message(Base):
     __tablename__ = "messages"
+    # History pages are read per room, newest id first.
+    __table_args__ = (Index("ix_messages_room_id", "room", "id"),)
 
     id = Column(Integer, primary_key=True, autoincrement=True)
+    room = Column(String(64), nullable=False, default=DEFAULT_ROOM, server_default=DEFAULT_ROOM)
     user_id = Column(UUID(as_uuid=True), ForeignKey("users.user_id"))
     content = Column(String, nullable=False)
     created_at = Column(DateTime(timezone=True), default=func.now())
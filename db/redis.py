@@ -1,36 +1,148 @@
+import time
+from typing import Dict
 from typing import Optional
 from apscheduler.jobstores.redis import RedisJobStore
+from redis.asyncio import BlockingConnectionPool
 from redis.asyncio import Redis
+from redis.commands.core import AsyncScript
+from metrics import REDIS_COMMAND_LATENCY
+import settings
 from settings import REDIS_URL
 
+####################################################
+# BLOCK WITH SHARED REDIS POOLS (ONE PER REDIS DB) #
+####################################################
+
+REDIS_AUTH_DB = 0
+REDIS_MESSAGES_DB = 1
+REDIS_CHAT_AUTH_DB = 2
+REDIS_SCHEDULER_DB = 3
+
 redis_pool_auth: Optional[Redis] = None
 redis_scheduler_pool: Optional[Redis] = None
 redis_pool_chat_auth: Optional[Redis] = None
 redis_pool_messages: Optional[Redis] = None
 
+_POOL_NAMES = {
+    "auth": ("redis_pool_auth", REDIS_AUTH_DB),
+    "messages": ("redis_pool_messages", REDIS_MESSAGES_DB),
+    "chat_auth": ("redis_pool_chat_auth", REDIS_CHAT_AUTH_DB),
+    "scheduler": ("redis_scheduler_pool", REDIS_SCHEDULER_DB),
+}
+_pools: Dict[str, BlockingConnectionPool] = {}
+_scripts: Dict[str, AsyncScript] = {}
+
+# Returns the session stored under KEYS[1] unless its "exp_ts" is before
+# ARGV[1], in which case the key is deleted in the same round-trip.
+CHECK_SESSION_SCRIPT = """
+local session = redis.call('GET', KEYS[1])
+if not session then
+    return nil
+end
+local exp_ts = cjson.decode(session)['exp_ts']
+if exp_ts and tonumber(exp_ts) < tonumber(ARGV[1]) then
+    redis.call('DEL', KEYS[1])
+    return nil
+end
+return session
+"""
+
+
+def _create_pool(db: int) -> BlockingConnectionPool:
+    return BlockingConnectionPool.from_url(
+        REDIS_URL,
+        db=db,
+        encoding="utf-8",
+        decode_responses=True,
+        max_connections=settings.REDIS_MAX_CONNECTIONS,
+        timeout=settings.REDIS_POOL_TIMEOUT,
+        socket_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=settings.REDIS_SOCKET_TIMEOUT,
+        health_check_interval=settings.REDIS_HEALTH_CHECK_INTERVAL,
+    )
+
+
+class InstrumentedRedis(Redis):
+    """Client that times every command it sends. Pipelines and pub/sub
+    bypass ``execute_command`` and are not timed."""
+
+    pool_name = ""
+
+    async def execute_command(self, *args, **options):
+        started = time.perf_counter()
+        try:
+            return await super().execute_command(*args, **options)
+        finally:
+            REDIS_COMMAND_LATENCY.labels(self.pool_name, args[0]).observe(
+                time.perf_counter() - started
+            )
+
+
+def _get_client(name: str) -> Redis:
+    """Returns the client bound to the shared pool, creating the pool lazily
+    for code running outside the application lifespan (scripts, workers)."""
+    global_name, db = _POOL_NAMES[name]
+    client = globals()[global_name]
+    if client is None:
+        _pools[name] = _create_pool(db)
+        client = InstrumentedRedis(connection_pool=_pools[name])
+        client.pool_name = name
+        globals()[global_name] = client
+    return client
+
+
+async def init_redis_pools():
+    """Creates every pool and checks that Redis is reachable. Called on startup."""
+    for name in _POOL_NAMES:
+        await _get_client(name).ping()
+
+
+async def close_redis_pools():
+    """Disconnects every pool. Called on shutdown."""
+    for name, pool in list(_pools.items()):
+        await pool.disconnect()
+        globals()[_POOL_NAMES[name][0]] = None
+    _pools.clear()
+
+
+async def run_script(redis: Redis, source: str, keys: list, args: list):
+    """Runs a Lua script with EVALSHA, loading it on first use."""
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = redis.register_script(source)
+    return await script(keys=keys, args=args, client=redis)
+
+
+def get_redis_pool_stats() -> Dict[str, dict]:
+    """Saturation snapshot of every pool, used to size REDIS_MAX_CONNECTIONS."""
+    stats = {}
+    for name, pool in _pools.items():
+        in_use = len(pool._in_use_connections)
+        idle = len(pool._available_connections)
+        stats[name] = {
+            "max_connections": pool.max_connections,
+            "created": in_use + idle,
+            "in_use": in_use,
+            "idle": idle,
+            "saturation": round(in_use / pool.max_connections, 3),
+        }
+    return stats
+
 
 async def get_redis_auth_pool() -> Redis:
-    return await Redis.from_url(
-        REDIS_URL, encoding="utf-8", decode_responses=True, db=0
-    )
+    return _get_client("auth")
 
 
 async def get_redis_messages_pool() -> Redis:
-    return await Redis.from_url(
-        REDIS_URL, encoding="utf-8", decode_responses=True, db=1
-    )
+    return _get_client("messages")
 
 
 async def get_redis_chat_auth_pool() -> Redis:
-    return await Redis.from_url(
-        REDIS_URL, encoding="utf-8", decode_responses=True, db=2
-    )
+    return _get_client("chat_auth")
 
 
 async def get_redis_scheduler_pool() -> Redis:
-    return await Redis.from_url(
-        REDIS_URL, encoding="utf-8", decode_responses=True, db=3
-    )
+    return _get_client("scheduler")
 
 
 scheduler = {
@@ -38,9 +150,3 @@ scheduler = {
         jobs_key='apscheduler.jobs', run_times_key='apscheduler.run_times', host='localhost', port=6379, db=3
     )
 }
-
-
-
-
-
-
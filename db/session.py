@@ -1,10 +1,18 @@
+from typing import Dict
 from typing import Generator
 import asyncpg
 import ssl
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.ext.asyncio import AsyncEngine
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.asyncio import create_async_engine
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from metrics import DB_QUERY_LATENCY
 from settings import DATABASE_URL
+import settings
 
 ##############################################
 # BLOCK FOR COMMON INTERACTION WITH DATABASE #
@@ -25,17 +33,139 @@ async def connect():
         ssl=ssl_context
     )
 
-engine = create_async_engine(
-    DATABASE_URL,
-    future=True,
-    execution_options={"isolation_level": "AUTOCOMMIT"},
-    connect_args={
-        "timeout": 60,
-        "ssl": ssl_context
+# Engine settings per workload. The API profile serves request handlers
+# and chat sockets; background jobs (message flusher, scheduler) get their
+# own small pool so a burst of them cannot starve requests.
+POOL_PROFILES = {
+    "api": {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+    },
+    "background": {
+        "pool_size": settings.DB_BACKGROUND_POOL_SIZE,
+        "max_overflow": settings.DB_BACKGROUND_MAX_OVERFLOW,
+    },
+}
+
+pool_stats: Dict[str, dict] = {}
+
+_TIMED_STATEMENTS = {"SELECT", "INSERT", "UPDATE", "DELETE"}
+
+
+def _instrumented_pool(stats: dict):
+    """AsyncAdaptedQueuePool that records how long checkouts wait.
+
+    Stats live on the class, so pools recreated by the engine after an
+    invalidation keep reporting into the same dict.
+    """
+
+    class InstrumentedPool(AsyncAdaptedQueuePool):
+        def _do_get(self):
+            started = time.perf_counter()
+            try:
+                return super()._do_get()
+            except TimeoutError:
+                stats["timeouts"] += 1
+                raise
+            finally:
+                waited = time.perf_counter() - started
+                stats["checkouts"] += 1
+                stats["checkout_wait_total"] += waited
+                stats["checkout_wait_max"] = max(stats["checkout_wait_max"], waited)
+
+    return InstrumentedPool
+
+
+def _create_engine(profile: str) -> AsyncEngine:
+    stats = pool_stats[profile] = {
+        "checkouts": 0,
+        "checkout_wait_total": 0.0,
+        "checkout_wait_max": 0.0,
+        "timeouts": 0,
+        "connects": 0,
+        "invalidations": 0,
     }
-)
+    execution_options = {}
+    if settings.DB_ISOLATION_LEVEL:
+        execution_options["isolation_level"] = settings.DB_ISOLATION_LEVEL
+    new_engine = create_async_engine(
+        DATABASE_URL,
+        future=True,
+        poolclass=_instrumented_pool(stats),
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+        execution_options=execution_options,
+        connect_args={
+            "timeout": 60,
+            "ssl": ssl_context,
+            # asyncpg's own cache and SQLAlchemy's prepared statement cache;
+            # both must be 0 behind a transaction-pooling pgbouncer.
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        },
+        **POOL_PROFILES[profile],
+    )
+
+    @event.listens_for(new_engine.sync_engine, "connect")
+    def on_connect(dbapi_connection, connection_record):
+        stats["connects"] += 1
+
+    @event.listens_for(new_engine.sync_engine, "invalidate")
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        stats["invalidations"] += 1
+
+    @event.listens_for(new_engine.sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_started"] = time.perf_counter()
+
+    @event.listens_for(new_engine.sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("query_started", None)
+        if started is None:
+            return
+        verb = statement.lstrip()[:6].upper()
+        DB_QUERY_LATENCY.labels(profile, verb if verb in _TIMED_STATEMENTS else "OTHER").observe(
+            time.perf_counter() - started
+        )
+
+    return new_engine
+
+
+engine = _create_engine("api")
+background_engine = _create_engine("background")
+
+_engines = {"api": engine, "background": background_engine}
+
+
+def get_db_pool_stats() -> Dict[str, dict]:
+    """Saturation and checkout latency of every engine pool."""
+    result = {}
+    for profile, profile_engine in _engines.items():
+        pool = profile_engine.pool
+        stats = pool_stats[profile]
+        in_use = pool.checkedout()
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        result[profile] = {
+            **stats,
+            "checkout_wait_avg": stats["checkout_wait_total"] / (stats["checkouts"] or 1),
+            "pool_size": pool.size(),
+            "max_overflow": pool._max_overflow,
+            "overflow": max(pool.overflow(), 0),
+            "in_use": in_use,
+            "idle": pool.checkedin(),
+            "saturation": round(in_use / capacity, 3) if capacity else 0.0,
+        }
+    return result
+
+
+async def dispose_engines():
+    for profile_engine in _engines.values():
+        await profile_engine.dispose()
+
 
 async_session = sessionmaker(engine, expire_on_commit=False, class_=AsyncSession) # noqa
+background_session = sessionmaker(background_engine, expire_on_commit=False, class_=AsyncSession) # noqa
 
 async def get_db() -> Generator: # type: ignore
     """Dependency for getting async session"""
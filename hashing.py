@@ -1,7 +1,61 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from passlib.context import CryptContext
+import settings
+from metrics import HASHER_LATENCY
 
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
+# bcrypt releases the GIL, so a small thread pool keeps hashing off the
+# event loop; its size is the cap on concurrent hashes per worker.
+_executor = ThreadPoolExecutor(
+    max_workers=settings.HASHER_MAX_WORKERS, thread_name_prefix="hasher"
+)
+
+hasher_stats = {
+    "calls": 0,
+    "in_flight": 0,
+    "queue_time_total": 0.0,
+    "queue_time_max": 0.0,
+    "run_time_total": 0.0,
+}
+
+
+def _timed_call(func, args):
+    started = time.perf_counter()
+    result = func(*args)
+    return started, time.perf_counter(), result
+
+
+async def _run_in_pool(func, *args):
+    submitted = time.perf_counter()
+    hasher_stats["in_flight"] += 1
+    try:
+        loop = asyncio.get_running_loop()
+        started, finished, result = await loop.run_in_executor(_executor, _timed_call, func, args)
+    finally:
+        hasher_stats["in_flight"] -= 1
+    queue_time = started - submitted
+    hasher_stats["calls"] += 1
+    hasher_stats["queue_time_total"] += queue_time
+    hasher_stats["queue_time_max"] = max(hasher_stats["queue_time_max"], queue_time)
+    hasher_stats["run_time_total"] += finished - started
+    HASHER_LATENCY.labels(func.__name__).observe(finished - submitted)
+    return result
+
+
+def get_hasher_stats() -> dict:
+    calls = hasher_stats["calls"] or 1
+    return {
+        "max_workers": settings.HASHER_MAX_WORKERS,
+        "calls": hasher_stats["calls"],
+        "in_flight": hasher_stats["in_flight"],
+        "queue_time_avg": hasher_stats["queue_time_total"] / calls,
+        "queue_time_max": hasher_stats["queue_time_max"],
+        "run_time_avg": hasher_stats["run_time_total"] / calls,
+    }
+
 
 class Hasher:
     @staticmethod
@@ -11,3 +65,11 @@ class Hasher:
     @staticmethod
     def get_password_hash(password: str) -> str:
         return pwd_context.hash(password)
+
+    @staticmethod
+    async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+        return await _run_in_pool(pwd_context.verify, plain_password, hashed_password)
+
+    @staticmethod
+    async def get_password_hash_async(password: str) -> str:
+        return await _run_in_pool(pwd_context.hash, password)
@@ -5,13 +5,24 @@ from fastapi.middleware.cors import CORSMiddleware
 from api.user.user_handler import user_router
 from api.auth.auth_handler import auth_router
 from api.message.message_handler import message_router
-from db.redis import get_redis_chat_auth_pool
-from db.redis import get_redis_scheduler_pool
-from db.redis import get_redis_messages_pool
-from db.redis import get_redis_auth_pool
+from api.stats.stats_handler import stats_router
+import settings
+from api.message.log_consumer import message_log_consumer
+from api.message.writer import message_writer
+from api.auth.session_cache import session_cache
+from api.auth.session_watcher import session_watcher
+from db.redis import init_redis_pools
+from db.redis import close_redis_pools
+from db.session import dispose_engines
 from scheduler.tasks import scheduler
+from scheduler.tasks import schedule_activation_code_sweeper
+from smtp.mail_queue import email_queue
+from websocket.action import manager
+from metrics import metrics_router
+from metrics import track_request_latency
 
 app = FastAPI()
+message_persister = message_log_consumer if settings.CHAT_MESSAGE_LOG == "stream" else message_writer
 origins = [
     "http://localhost",
     "http://localhost:3000",
@@ -24,34 +35,39 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.middleware("http")(track_request_latency)
 
 main_api_router = APIRouter()
 main_api_router.include_router(user_router, prefix="/user", tags=["user"])
 main_api_router.include_router(auth_router, prefix="/auth", tags=["authentication"])
 main_api_router.include_router(message_router, prefix="/messages", tags=["messages"])
+main_api_router.include_router(stats_router, prefix="/stats", tags=["stats"])
 app.include_router(main_api_router)
+app.include_router(metrics_router)
 
 
 @app.on_event("startup")
 async def startup_event():
-    await get_redis_auth_pool()
-    await get_redis_chat_auth_pool()
-    await get_redis_messages_pool()
-    await get_redis_scheduler_pool()
+    await init_redis_pools()
+    await session_cache.start()
+    await session_watcher.start()
+    await message_persister.start()
+    await email_queue.start()
+    await manager.start()
     scheduler.start()
+    schedule_activation_code_sweeper()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
-    redis_pool_auth = await get_redis_auth_pool()
-    redis_pool_chat_auth = await get_redis_chat_auth_pool()
-    redis_pool_message = await get_redis_messages_pool()
-    redis_scheduler_pool = await get_redis_scheduler_pool()
-    await redis_pool_message.close()
-    await redis_pool_chat_auth.close()
-    await redis_pool_auth.close()
-    await redis_scheduler_pool.close()
     scheduler.shutdown()
+    await manager.stop()
+    await message_persister.stop()
+    await email_queue.stop()
+    await session_watcher.stop()
+    await session_cache.stop()
+    await close_redis_pools()
+    await dispose_engines()
 
 
 if __name__ == "__main__":
@@ -59,4 +75,5 @@ if __name__ == "__main__":
         "main:app",
         host="127.0.0.1",
         port=8000,
+        ws_per_message_deflate=settings.WS_PER_MESSAGE_DEFLATE,
     )
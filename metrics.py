@@ -0,0 +1,113 @@
+import os
+import time
+from fastapi import APIRouter
+from fastapi import Request
+from fastapi import Response
+from prometheus_client import CONTENT_TYPE_LATEST
+from prometheus_client import CollectorRegistry
+from prometheus_client import Counter
+from prometheus_client import Gauge
+from prometheus_client import Histogram
+from prometheus_client import REGISTRY
+from prometheus_client import generate_latest
+from prometheus_client import multiprocess
+
+##################################################
+# BLOCK WITH PROMETHEUS METRICS OF THE HOT PATHS #
+##################################################
+
+# With several uvicorn/gunicorn workers, set PROMETHEUS_MULTIPROC_DIR to an
+# empty directory before start; every process then writes its samples there
+# and /metrics aggregates them.
+MULTIPROCESS = "PROMETHEUS_MULTIPROC_DIR" in os.environ
+
+# Chat frames are small and Redis commands sub-millisecond, so the default
+# buckets (which start at 5 ms) would put everything in the first one.
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+HTTP_REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency by route template.",
+    ["method", "route", "status"],
+)
+CHAT_CONNECTIONS = Gauge(
+    "chat_active_connections",
+    "Open /messages/ws sockets.",
+    multiprocess_mode="livesum",
+)
+CHAT_MESSAGES_SENT = Counter(
+    "chat_messages_sent_total",
+    "Chat messages accepted from clients.",
+)
+CHAT_FAN_OUT_LATENCY = Histogram(
+    "chat_fan_out_duration_seconds",
+    "Time to queue one frame for every local socket.",
+    ["kind"],
+    buckets=FAST_BUCKETS,
+)
+CHAT_FRAMES_QUEUED = Counter(
+    "chat_frames_queued_total",
+    "Frames queued to socket outboxes by fan-out.",
+    ["kind"],
+)
+REDIS_COMMAND_LATENCY = Histogram(
+    "redis_command_duration_seconds",
+    "Redis command round-trip time.",
+    ["pool", "command"],
+    buckets=FAST_BUCKETS,
+)
+DB_QUERY_LATENCY = Histogram(
+    "db_query_duration_seconds",
+    "SQL statement execution time.",
+    ["engine", "statement"],
+    buckets=FAST_BUCKETS,
+)
+HASHER_LATENCY = Histogram(
+    "hasher_duration_seconds",
+    "bcrypt call time, including the wait for a hasher thread.",
+    ["operation"],
+)
+EMAIL_DELIVERY_LATENCY = Histogram(
+    "email_delivery_duration_seconds",
+    "Time from enqueueing an email to its successful SMTP delivery, retries included.",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 900.0),
+)
+ACTIVATION_CODES_EXHAUSTED = Counter(
+    "activation_codes_exhausted_total",
+    "Registrations refused because every generated activation code was taken.",
+)
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+async def get_metrics() -> Response:
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+
+async def track_request_latency(request: Request, call_next):
+    """HTTP middleware observing latency under the route template, so
+    path parameters do not explode the label set."""
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        if route is not None and route.path != "/metrics":
+            HTTP_REQUEST_LATENCY.labels(request.method, route.path, status).observe(
+                time.perf_counter() - started
+            )
+
+
+def mark_process_dead(pid: int):
+    """Gunicorn ``child_exit`` hook: drops live gauges of a dead worker."""
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(pid)
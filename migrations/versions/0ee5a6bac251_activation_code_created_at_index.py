@@ -0,0 +1,26 @@
+"""activation code created_at index
+
+Revision ID: 0ee5a6bac251
+Revises: 44f77127f32d
+Create Date: 2026-10-18 10:31:52.640378
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0ee5a6bac251'
+down_revision: Union[str, None] = '44f77127f32d'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index(op.f('ix_account_activation_codes_created_at'), 'account_activation_codes', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_account_activation_codes_created_at'), table_name='account_activation_codes')
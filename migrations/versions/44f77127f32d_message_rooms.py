@@ -0,0 +1,29 @@
+"""message rooms
+
+Revision ID: 44f77127f32d
+Revises: 6b46bc3767eb
+Create Date: 2026-10-18 10:14:07.902117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '44f77127f32d'
+down_revision: Union[str, None] = '6b46bc3767eb'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # The server default puts every existing message into the default room.
+    op.add_column('messages', sa.Column('room', sa.String(length=64), server_default='general', nullable=False))
+    op.create_index('ix_messages_room_id', 'messages', ['room', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_messages_room_id', table_name='messages')
+    op.drop_column('messages', 'room')
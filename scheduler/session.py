@@ -1,6 +1,6 @@
-from db.session import async_session
+from db.session import background_session
 
 
 def async_session_factory():
     """Factory function to generate new SQLAlchemy AsyncSession instances."""
-    return async_session()
+    return background_session()
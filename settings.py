@@ -1,15 +1,33 @@
+import os
 from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 from envparse import Env
 
-load_dotenv(dotenv_path=".env",override=True)
+# ENV_FILE lets tooling (e.g. benchmarks.load_test) start the app against
+# a different configuration than the checked-out .env.
+load_dotenv(dotenv_path=os.environ.get("ENV_FILE", ".env"),override=True)
 env = Env()
 
 ekb_timezone = ZoneInfo("Asia/Yekaterinburg")
 
 
 DATABASE_URL: str = env.str("DATABASE_URL")
+DB_POOL_SIZE: int = env.int("DB_POOL_SIZE", default=10)
+DB_MAX_OVERFLOW: int = env.int("DB_MAX_OVERFLOW", default=10)
+DB_BACKGROUND_POOL_SIZE: int = env.int("DB_BACKGROUND_POOL_SIZE", default=3)
+DB_BACKGROUND_MAX_OVERFLOW: int = env.int("DB_BACKGROUND_MAX_OVERFLOW", default=2)
+DB_POOL_TIMEOUT: int = env.int("DB_POOL_TIMEOUT", default=10)
+DB_POOL_RECYCLE: int = env.int("DB_POOL_RECYCLE", default=1800)
+DB_POOL_PRE_PING: bool = env.bool("DB_POOL_PRE_PING", default=True)
+# Set to 0 behind a transaction-pooling pgbouncer.
+DB_STATEMENT_CACHE_SIZE: int = env.int("DB_STATEMENT_CACHE_SIZE", default=100)
+# Empty uses the server default (READ COMMITTED) with real transactions.
+DB_ISOLATION_LEVEL: str = env.str("DB_ISOLATION_LEVEL", default="AUTOCOMMIT")
 REDIS_URL: str = env.str("REDIS_URL")
+REDIS_MAX_CONNECTIONS: int = env.int("REDIS_MAX_CONNECTIONS", default=50)
+REDIS_POOL_TIMEOUT: int = env.int("REDIS_POOL_TIMEOUT", default=5)
+REDIS_SOCKET_TIMEOUT: int = env.int("REDIS_SOCKET_TIMEOUT", default=5)
+REDIS_HEALTH_CHECK_INTERVAL: int = env.int("REDIS_HEALTH_CHECK_INTERVAL", default=30)
 
 
 SECRET_KEY: str = env.str("SECRET_KEY")
@@ -19,11 +37,68 @@ SMTP_USER: str = env.str("SMTP_USER")
 SMTP_PASSWORD: str = env.str("SMTP_PASSWORD")
 SMTP_HOST: str = env.str("SMTP_HOST")
 SMTP_PORT: int = env.int("SMTP_PORT")
+# Set to false to talk plain SMTP, e.g. to a local aiosmtpd stand-in.
+SMTP_USE_SSL: bool = env.bool("SMTP_USE_SSL", default=True)
+SMTP_TIMEOUT: int = env.int("SMTP_TIMEOUT", default=10)
+SMTP_IDLE_TIMEOUT: int = env.int("SMTP_IDLE_TIMEOUT", default=60)
+EMAIL_WORKERS: int = env.int("EMAIL_WORKERS", default=2)
+EMAIL_MAX_ATTEMPTS: int = env.int("EMAIL_MAX_ATTEMPTS", default=5)
+EMAIL_RETRY_DELAY: int = env.int("EMAIL_RETRY_DELAY", default=5)
 
 
+CHAT_DISTRIBUTED: bool = env.bool("CHAT_DISTRIBUTED", default=False)
+CHAT_PUBSUB_CHANNEL: str = env.str("CHAT_PUBSUB_CHANNEL", default="chat_events")
+# auto | orjson | json
+CHAT_JSON_ENCODER: str = env.str("CHAT_JSON_ENCODER", default="auto")
+# Offer permessage-deflate on WebSockets; read by `python main.py`, pass
+# --ws-per-message-deflate to the uvicorn CLI for the same effect.
+WS_PER_MESSAGE_DEFLATE: bool = env.bool("WS_PER_MESSAGE_DEFLATE", default=True)
+CHAT_SEND_QUEUE_SIZE: int = env.int("CHAT_SEND_QUEUE_SIZE", default=256)
+# drop_oldest | drop_typing | disconnect
+CHAT_SLOW_CONSUMER_POLICY: str = env.str("CHAT_SLOW_CONSUMER_POLICY", default="drop_typing")
+CHAT_MAX_ROOMS_PER_SOCKET: int = env.int("CHAT_MAX_ROOMS_PER_SOCKET", default=20)
+CHAT_RECENT_HISTORY_SIZE: int = env.int("CHAT_RECENT_HISTORY_SIZE", default=100)
+CHAT_RECENT_HISTORY_ROOMS: int = env.int("CHAT_RECENT_HISTORY_ROOMS", default=1000)
+# A reconnect that missed more messages than this reloads the room instead.
+CHAT_RESUME_MAX_MESSAGES: int = env.int("CHAT_RESUME_MAX_MESSAGES", default=500)
+CHAT_PRESENCE_DEBOUNCE_MS: int = env.int("CHAT_PRESENCE_DEBOUNCE_MS", default=200)
+CHAT_TYPING_TTL_MS: int = env.int("CHAT_TYPING_TTL_MS", default=5000)
+CHAT_TYPING_FLUSH_MS: int = env.int("CHAT_TYPING_FLUSH_MS", default=300)
+
+MESSAGE_FLUSH_BATCH_SIZE: int = env.int("MESSAGE_FLUSH_BATCH_SIZE", default=200)
+MESSAGE_FLUSH_INTERVAL_MS: int = env.int("MESSAGE_FLUSH_INTERVAL_MS", default=250)
+MESSAGE_MAX_PENDING: int = env.int("MESSAGE_MAX_PENDING", default=10000)
+# zset: per-room sorted sets, rows written behind from process memory.
+# stream: per-room Redis Streams, rows drained from a log stream by a
+# consumer group, so unpersisted messages survive a worker crash.
+CHAT_MESSAGE_LOG: str = env.str("CHAT_MESSAGE_LOG", default="zset")
+MESSAGE_LOG_STREAM: str = env.str("MESSAGE_LOG_STREAM", default="chat_log")
+MESSAGE_LOG_GROUP: str = env.str("MESSAGE_LOG_GROUP", default="chat_persister")
+# Log entries Postgres refuses to store end up here instead of blocking the log.
+MESSAGE_LOG_DEAD_LETTER_STREAM: str = env.str("MESSAGE_LOG_DEAD_LETTER_STREAM", default="chat_log:dead")
+# Empty means hostname-pid; set it to keep a worker's name across restarts.
+MESSAGE_LOG_CONSUMER: str = env.str("MESSAGE_LOG_CONSUMER", default="")
+MESSAGE_LOG_BLOCK_MS: int = env.int("MESSAGE_LOG_BLOCK_MS", default=1000)
+MESSAGE_LOG_CLAIM_IDLE_MS: int = env.int("MESSAGE_LOG_CLAIM_IDLE_MS", default=60000)
+
+HASHER_MAX_WORKERS: int = env.int("HASHER_MAX_WORKERS", default=4)
+
+SESSION_CACHE_SIZE: int = env.int("SESSION_CACHE_SIZE", default=10000)
+SESSION_CACHE_TTL: int = env.int("SESSION_CACHE_TTL", default=60)
+SESSION_INVALIDATION_CHANNEL: str = env.str("SESSION_INVALIDATION_CHANNEL", default="session_invalidation")
+# How often /auth/ws sockets are re-checked in Redis even without an invalidation:
+# one EXISTS per connected user per interval, only a backstop for a lost
+# pub/sub message (a listener failure already triggers a re-check).
+SESSION_RECONCILE_INTERVAL: int = env.int("SESSION_RECONCILE_INTERVAL", default=600)
+
+USER_CACHE_SIZE: int = env.int("USER_CACHE_SIZE", default=10000)
+USER_CACHE_TTL: int = env.int("USER_CACHE_TTL", default=300)
+USER_NEGATIVE_CACHE_TTL: int = env.int("USER_NEGATIVE_CACHE_TTL", default=30)
+
 ACCESS_TOKEN_EXPIRE_MINUTES: int = env.int("ACCESS_TOKEN_EXPIRE_MINUTES")
 CHAT_TOKEN_EXPIRE_MINUTES: int = env.int("CHAT_TOKEN_EXPIRE_MINUTES")
 ACTIVATION_CODE_EXPIRE_MINUTES: int = env.int("ACTIVATION_CODE_EXPIRE_MINUTES")
+ACTIVATION_SWEEP_INTERVAL_SECONDS: int = env.int("ACTIVATION_SWEEP_INTERVAL_SECONDS", default=30)
 
 print(f"CHAT_TOKEN_EXPIRE_MINUTES: {CHAT_TOKEN_EXPIRE_MINUTES}")
 print(f"ACCESS_TOKEN_EXPIRE_MINUTES: {ACCESS_TOKEN_EXPIRE_MINUTES}")
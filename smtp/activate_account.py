@@ -1,32 +1,56 @@
+import hashlib
 import logging
-import smtplib
-import random
-from typing import cast
 from email.mime.multipart import MIMEMultipart
 from email.mime.text import MIMEText
-from sqlalchemy import ColumnElement
-from sqlalchemy.future import select
-from sqlalchemy.ext.asyncio import AsyncSession
-from db.models import ActivationCode
+from db.redis import get_redis_scheduler_pool
+from .mail_queue import email_queue
 import settings
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+ACTIVATION_CODE_COUNTER_KEY = "activation_code_counter"
+CODE_MIN = 100000
+CODE_SPACE = 900000
 
-async def generate_activation_code(session: AsyncSession):
-    while True:
-        code = f"{random.randint(100000, 999999)}"
-        exist_query = select(ActivationCode).where(cast("ColumnElement[bool]", ActivationCode.code == code))
-        result = await session.execute(exist_query)
-        if result.scalar_one_or_none() is None:
-            return code
+# Codes are a keyed permutation of a Redis counter: a 20-bit Feistel
+# network restricted to CODE_SPACE by cycle-walking. Consecutive codes
+# are unrelated to an observer, yet no two counter values within a
+# cycle of CODE_SPACE signups map to the same code.
+_HALF_BITS = 10
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_ROUND_KEYS = [
+    hashlib.sha256(f"{settings.SECRET_KEY}:activation-code:{round_}".encode()).digest()
+    for round_ in range(4)
+]
+
+
+def _feistel(value: int) -> int:
+    left, right = value >> _HALF_BITS, value & _HALF_MASK
+    for key in _ROUND_KEYS:
+        digest = hashlib.blake2b(right.to_bytes(2, "big"), key=key, digest_size=2).digest()
+        left, right = right, left ^ (int.from_bytes(digest, "big") & _HALF_MASK)
+    return (left << _HALF_BITS) | right
+
+
+def scramble_code_index(index: int) -> int:
+    """Bijection of [0, CODE_SPACE) onto itself."""
+    value = _feistel(index)
+    while value >= CODE_SPACE:
+        value = _feistel(value)
+    return value
+
+
+async def generate_activation_code() -> str:
+    redis = await get_redis_scheduler_pool()
+    index = await redis.incr(ACTIVATION_CODE_COUNTER_KEY) % CODE_SPACE
+    return f"{CODE_MIN + scramble_code_index(index)}"
 
 
 async def send_activation_code(email: str, activation_code: str):
+    """Queues the activation email; smtp.mail_queue workers deliver it."""
     sender_email = settings.SMTP_USER
     receiver_email = email
-    password = settings.SMTP_PASSWORD
 
     message = MIMEMultipart("alternative")
     message["Subject"] = "Activation Code"
@@ -40,9 +64,6 @@ async def send_activation_code(email: str, activation_code: str):
     message.attach(part)
 
     try:
-        server = smtplib.SMTP_SSL(settings.SMTP_HOST, settings.SMTP_PORT)
-        server.login(sender_email, password)
-        server.sendmail(sender_email, receiver_email, message.as_string())
-        server.quit()
+        await email_queue.enqueue(sender_email, receiver_email, message.as_string())
     except Exception as e:
-        logger.info(f"Error sending email: {e}")
+        logger.info(f"Error queueing email: {e}")
@@ -0,0 +1,249 @@
+import asyncio
+import json
+import logging
+import smtplib
+import time
+from typing import List
+from typing import Optional
+from uuid import uuid4
+from db.redis import get_redis_scheduler_pool
+from db.redis import run_script
+from metrics import EMAIL_DELIVERY_LATENCY
+import settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Jobs are LPUSHed and taken from the right with BRPOPLPUSH, which (unlike
+# BLMOVE) exists before Redis 6.2.
+EMAIL_QUEUE_KEY = "email_queue"
+EMAIL_RETRY_KEY = "email_queue:retry"
+EMAIL_DEAD_KEY = "email_queue:dead"
+EMAIL_PROCESSING_PREFIX = "email_queue:processing:"
+EMAIL_HEARTBEAT_PREFIX = "email_queue:worker:"
+HEARTBEAT_TTL = 30
+
+# Moves retries that are due (score <= ARGV[1]) back onto the queue.
+MOVE_DUE_RETRIES_SCRIPT = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, 100)
+for _, job in ipairs(due) do
+    redis.call('ZREM', KEYS[1], job)
+    redis.call('LPUSH', KEYS[2], job)
+end
+return #due
+"""
+
+# Hands every job of a processing list back to the head (right end) of the
+# queue, the oldest one last so that it is taken first.
+REQUEUE_SCRIPT = """
+local moved = 0
+local job = redis.call('LPOP', KEYS[1])
+while job do
+    redis.call('RPUSH', KEYS[2], job)
+    moved = moved + 1
+    job = redis.call('LPOP', KEYS[1])
+end
+return moved
+"""
+
+email_stats = {
+    "enqueued": 0,
+    "delivered": 0,
+    "retried": 0,
+    "dead": 0,
+    "latency_total": 0.0,
+    "latency_max": 0.0,
+}
+
+
+class SmtpConnection:
+    """One SMTP session reused across messages. Its methods block, so the
+    queue workers call them through ``asyncio.to_thread``."""
+
+    def __init__(self):
+        self._server: Optional[smtplib.SMTP] = None
+        self._last_used = 0.0
+
+    def _connect(self) -> smtplib.SMTP:
+        smtp_class = smtplib.SMTP_SSL if settings.SMTP_USE_SSL else smtplib.SMTP
+        server = smtp_class(settings.SMTP_HOST, settings.SMTP_PORT, timeout=settings.SMTP_TIMEOUT)
+        if settings.SMTP_USER:
+            server.login(settings.SMTP_USER, settings.SMTP_PASSWORD)
+        return server
+
+    def send(self, sender: str, recipient: str, message: str):
+        if self._server is None:
+            self._server = self._connect()
+        try:
+            self._server.sendmail(sender, recipient, message)
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped the idle session: reconnect once and resend.
+            self._server = self._connect()
+            self._server.sendmail(sender, recipient, message)
+        except Exception:
+            self.close()
+            raise
+        self._last_used = time.monotonic()
+
+    def close_if_idle(self):
+        if self._server is not None and time.monotonic() - self._last_used > settings.SMTP_IDLE_TIMEOUT:
+            self.close()
+
+    def close(self):
+        if self._server is not None:
+            try:
+                self._server.quit()
+            except Exception:
+                pass
+            self._server = None
+
+
+class EmailQueue:
+    """Redis-backed outbound mail queue drained by long-lived async workers.
+
+    A worker moves a job into its own processing list while sending it, so
+    jobs of a crashed process are handed back once its heartbeat expires.
+    Failed deliveries are retried with exponential backoff and parked in
+    ``EMAIL_DEAD_KEY`` after ``max_attempts``.
+    """
+
+    def __init__(self, workers: int, max_attempts: int, retry_delay: float):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.worker_id = uuid4().hex[:12]
+        self._stopping = False
+        self._tasks: List[asyncio.Task] = []
+        self._maintenance: Optional[asyncio.Task] = None
+
+    def _processing_key(self, index: int) -> str:
+        return f"{EMAIL_PROCESSING_PREFIX}{self.worker_id}:{index}"
+
+    async def start(self):
+        self._stopping = False
+        await self._heartbeat()
+        self._tasks = [asyncio.create_task(self._work(index)) for index in range(self.workers)]
+        self._maintenance = asyncio.create_task(self._maintain())
+
+    async def stop(self):
+        self._stopping = True
+        if self._maintenance is not None:
+            self._maintenance.cancel()
+        if self._tasks:
+            # Let in-flight deliveries finish before handing queued work back.
+            _, pending = await asyncio.wait(self._tasks, timeout=settings.SMTP_TIMEOUT + 2)
+            for task in pending:
+                task.cancel()
+        redis = await get_redis_scheduler_pool()
+        for index in range(self.workers):
+            await run_script(
+                redis, REQUEUE_SCRIPT, keys=[self._processing_key(index), EMAIL_QUEUE_KEY], args=[]
+            )
+        await redis.delete(f"{EMAIL_HEARTBEAT_PREFIX}{self.worker_id}")
+        self._tasks = []
+
+    async def enqueue(self, sender: str, recipient: str, message: str):
+        job = {
+            "sender": sender,
+            "recipient": recipient,
+            "message": message,
+            "attempts": 0,
+            "enqueued_at": time.time(),
+        }
+        redis = await get_redis_scheduler_pool()
+        await redis.lpush(EMAIL_QUEUE_KEY, json.dumps(job))
+        email_stats["enqueued"] += 1
+
+    async def _work(self, index: int):
+        processing_key = self._processing_key(index)
+        connection = SmtpConnection()
+        try:
+            while not self._stopping:
+                try:
+                    redis = await get_redis_scheduler_pool()
+                    raw_job = await redis.brpoplpush(EMAIL_QUEUE_KEY, processing_key, 1)
+                    if raw_job is None:
+                        await asyncio.to_thread(connection.close_if_idle)
+                        continue
+                    await self._deliver(connection, redis, processing_key, raw_job)
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    logger.error(f"Error in email worker {index}: {e}")
+                    await asyncio.sleep(1)
+        finally:
+            await asyncio.to_thread(connection.close)
+
+    async def _deliver(self, connection: SmtpConnection, redis, processing_key: str, raw_job: str):
+        job = json.loads(raw_job)
+        try:
+            await asyncio.to_thread(connection.send, job["sender"], job["recipient"], job["message"])
+        except Exception as e:
+            job["attempts"] += 1
+            async with redis.pipeline(transaction=True) as pipe:
+                pipe.lrem(processing_key, 1, raw_job)
+                if job["attempts"] >= self.max_attempts:
+                    logger.error(f"Giving up on email to {job['recipient']}: {e}")
+                    pipe.rpush(EMAIL_DEAD_KEY, json.dumps(job))
+                    email_stats["dead"] += 1
+                else:
+                    delay = self.retry_delay * 2 ** (job["attempts"] - 1)
+                    logger.info(f"Retrying email to {job['recipient']} in {delay}s: {e}")
+                    pipe.zadd(EMAIL_RETRY_KEY, {json.dumps(job): time.time() + delay})
+                    email_stats["retried"] += 1
+                await pipe.execute()
+            return
+        await redis.lrem(processing_key, 1, raw_job)
+        latency = time.time() - job["enqueued_at"]
+        email_stats["delivered"] += 1
+        email_stats["latency_total"] += latency
+        email_stats["latency_max"] = max(email_stats["latency_max"], latency)
+        EMAIL_DELIVERY_LATENCY.observe(latency)
+
+    async def _heartbeat(self):
+        redis = await get_redis_scheduler_pool()
+        await redis.set(f"{EMAIL_HEARTBEAT_PREFIX}{self.worker_id}", 1, ex=HEARTBEAT_TTL)
+
+    async def _maintain(self):
+        ticks = 0
+        while True:
+            try:
+                redis = await get_redis_scheduler_pool()
+                await run_script(
+                    redis, MOVE_DUE_RETRIES_SCRIPT, keys=[EMAIL_RETRY_KEY, EMAIL_QUEUE_KEY], args=[time.time()]
+                )
+                if ticks % 10 == 0:
+                    await self._heartbeat()
+                    await self._recover_orphans(redis)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error in email queue maintenance: {e}")
+            ticks += 1
+            await asyncio.sleep(1)
+
+    async def _recover_orphans(self, redis):
+        """Requeues jobs left in the processing lists of dead processes."""
+        async for key in redis.scan_iter(match=f"{EMAIL_PROCESSING_PREFIX}*"):
+            owner = key[len(EMAIL_PROCESSING_PREFIX):].split(":")[0]
+            if not await redis.exists(f"{EMAIL_HEARTBEAT_PREFIX}{owner}"):
+                moved = await run_script(redis, REQUEUE_SCRIPT, keys=[key, EMAIL_QUEUE_KEY], args=[])
+                logger.info(f"Requeued {moved} emails left by worker {owner}")
+
+
+async def get_email_stats() -> dict:
+    redis = await get_redis_scheduler_pool()
+    delivered = email_stats["delivered"] or 1
+    return {
+        **email_stats,
+        "latency_avg": email_stats["latency_total"] / delivered,
+        "queued": await redis.llen(EMAIL_QUEUE_KEY),
+        "scheduled_retries": await redis.zcard(EMAIL_RETRY_KEY),
+    }
+
+
+email_queue = EmailQueue(
+    workers=settings.EMAIL_WORKERS,
+    max_attempts=settings.EMAIL_MAX_ATTEMPTS,
+    retry_delay=settings.EMAIL_RETRY_DELAY,
+)
@@ -1,53 +1,79 @@
-import json
-from api.message.actions import get_messages
+import settings
+from db.models import DEFAULT_ROOM
+from websocket.bus import ChatBus
+from websocket.protocol import receive_frame
 from websocket.socket import ConnectionManager
+from websocket.socket import valid_room
 
-manager = ConnectionManager()
+manager = ConnectionManager(
+    bus=ChatBus(settings.CHAT_PUBSUB_CHANNEL) if settings.CHAT_DISTRIBUTED else None
+)
 
 
-async def handle_messages(websocket, user, db, redis_messages):
+def _optional_int(value) -> bool:
+    return value is None or (isinstance(value, int) and not isinstance(value, bool))
+
+
+async def handle_messages(websocket, user, redis_messages):
     while True:
-        data = await websocket.receive_text()
-        parsed_data = json.loads(data)
+        parsed_data = await receive_frame(websocket)
         action = parsed_data.get("action")
+        room = parsed_data.get("room", DEFAULT_ROOM)
+        if not valid_room(room):
+            manager.send_error(websocket, "Некорректное название комнаты.")
+            continue
 
         if action == "send_message":
             content = parsed_data.get("content")
-            await manager.send_personal_message(content, websocket, db, redis_messages)
-            await manager.broadcast_message(content, user.username, websocket)
+            if not isinstance(content, str) or not content.strip():
+                manager.send_error(websocket, "Сообщение не может быть пустым.")
+                continue
+            manager.broadcast_stop_typing(user.username, websocket, room)
+            saved_message = await manager.send_personal_message(content, websocket, redis_messages, room)
+            if saved_message is not None:
+                await manager.broadcast_message(
+                    content, user.username, websocket, room=room, saved_message=saved_message
+                )
 
         elif action == "typing":
-            await manager.broadcast_typing(user.username, websocket)
+            if manager.in_room(websocket, room):
+                manager.broadcast_typing(user.username, websocket, room)
 
         elif action == "stop_typing":
-            await manager.broadcast_stop_typing(user.username, websocket)
+            manager.broadcast_stop_typing(user.username, websocket, room)
 
-        elif action == "load_more_messages":
-            await load_more_messages(websocket, redis_messages)
+        elif action == "join_room":
+            since = parsed_data.get("since")
+            if not _optional_int(since):
+                continue
+            await manager.join_room(websocket, room, redis_messages, since)
 
+        elif action == "leave_room":
+            manager.leave_room(websocket, room)
 
-async def load_more_messages(websocket, redis_messages):
-    current_index = manager.last_message_index[websocket]
-    new_start = current_index - 20
-    more_messages = await get_messages(
-        redis_pool_messages=redis_messages, start=new_start, count=20
-    )
-    await websocket.send_text(
-        json.dumps({"type": "more_messages", "messages": more_messages})
-    )
-    manager.last_message_index[websocket] = new_start
+        elif action == "get_users":
+            await manager.send_active_users(websocket)
+
+        elif action == "load_more_messages":
+            before_id = parsed_data.get("before_id")
+            if not _optional_int(before_id):
+                continue
+            await manager.load_more_messages(websocket, redis_messages, before_id, room)
 
 
-async def handle_websocket_disconnect(user, websocket, db):
-    await manager.disconnect(websocket, db)
+async def handle_websocket_disconnect(user, websocket):
+    if websocket not in manager.active_connections:
+        # Never connected, or the connect already cleaned up after itself.
+        return
+    await manager.disconnect(websocket)
     leave_message = f"Пользователь {user.username} вышел из чата."
     await manager.broadcast_message(
         leave_message, user.username, websocket, system_message=True
     )
 
 
-async def handle_websocket_connect(user, websocket, db, redis_messages):
-    await manager.connect(websocket, user, db, redis_messages)
+async def handle_websocket_connect(user, websocket, redis_messages, since=None):
+    await manager.connect(websocket, user, redis_messages, since)
     join_message = f"Пользователь {user.username} присоединился к чату."
     await manager.broadcast_message(
         join_message, user.username, websocket, system_message=True
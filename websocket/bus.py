@@ -0,0 +1,237 @@
+import asyncio
+import logging
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from uuid import uuid4
+from redis.asyncio import Redis
+from redis.asyncio.client import PubSub
+from db.redis import get_redis_messages_pool
+from db.redis import run_script
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Socket counts per user: the total over live workers, and one hash per
+# worker so the share of a worker that died can be taken back out.
+ONLINE_USERS_KEY = "chat_online_users"
+WORKER_USERS_PREFIX = "chat_online_users:"
+WORKERS_KEY = "chat_workers"
+WORKER_HEARTBEAT_PREFIX = "chat_worker:"
+HEARTBEAT_TTL = 30
+HEARTBEAT_INTERVAL = 10
+ALL_ROOMS = "*"
+
+# Counts one more socket of the user on this worker; returns the total.
+USER_JOINED_SCRIPT = """
+redis.call('HINCRBY', KEYS[2], ARGV[1], 1)
+return redis.call('HINCRBY', KEYS[1], ARGV[1], 1)
+"""
+
+# Counts one socket less on this worker and in total, dropping fields at
+# zero; returns the remaining total.
+USER_LEFT_SCRIPT = """
+if redis.call('HINCRBY', KEYS[2], ARGV[1], -1) <= 0 then
+    redis.call('HDEL', KEYS[2], ARGV[1])
+end
+local remaining = redis.call('HINCRBY', KEYS[1], ARGV[1], -1)
+if remaining <= 0 then
+    redis.call('HDEL', KEYS[1], ARGV[1])
+    return 0
+end
+return remaining
+"""
+
+# Takes the counts of worker ARGV[1] (hash KEYS[2]) out of the total and
+# puts the username/count pairs of ARGV[3..] in their place. The worker
+# stays registered in KEYS[3] when ARGV[2] is "1". Returns the users left
+# with no socket anywhere.
+REPLACE_WORKER_USERS_SCRIPT = """
+local counts = redis.call('HGETALL', KEYS[2])
+redis.call('DEL', KEYS[2])
+local gone = {}
+for i = 1, #counts, 2 do
+    if redis.call('HINCRBY', KEYS[1], counts[i], -tonumber(counts[i + 1])) <= 0 then
+        redis.call('HDEL', KEYS[1], counts[i])
+        gone[counts[i]] = true
+    end
+end
+for i = 3, #ARGV, 2 do
+    redis.call('HINCRBY', KEYS[2], ARGV[i], ARGV[i + 1])
+    redis.call('HINCRBY', KEYS[1], ARGV[i], ARGV[i + 1])
+    gone[ARGV[i]] = nil
+end
+if ARGV[2] == '1' then
+    redis.call('SADD', KEYS[3], ARGV[1])
+else
+    redis.call('SREM', KEYS[3], ARGV[1])
+end
+local result = {}
+for username in pairs(gone) do
+    table.insert(result, username)
+end
+return result
+"""
+
+
+class ChatBus:
+    """Relays chat frames between uvicorn workers over Redis pub/sub.
+
+    Every worker publishes its outbound frames to one channel and relays
+    whatever it receives to the sockets it holds locally. A message is
+    published as ``"<origin> <exclude> <kind> <room> <frame>"`` so the origin
+    worker can skip the sender's own socket, and every worker can pick the
+    room's sockets, without decoding the frame. Room ``*`` means everyone.
+
+    It also keeps the online counts of all workers. Each worker counts its
+    sockets in its own hash and refreshes a heartbeat; a worker whose
+    heartbeat has expired is purged by the others, and the users it leaves
+    without any socket are reported to ``on_users_gone``.
+    """
+
+    def __init__(self, channel: str):
+        self.channel = channel
+        self.worker_id = uuid4().hex[:12]
+        self._pubsub: Optional[PubSub] = None
+        self._listener: Optional[asyncio.Task] = None
+        self._heartbeat: Optional[asyncio.Task] = None
+        self._local_counts: Callable[[], Dict[str, int]] = dict
+        self._on_users_gone: Callable[[List[str]], None] = lambda usernames: None
+        self._reset_listeners: List[Callable[[], None]] = []
+
+    def watch_presence(
+        self,
+        local_counts: Callable[[], Dict[str, int]],
+        on_users_gone: Callable[[List[str]], None],
+    ):
+        self._local_counts = local_counts
+        self._on_users_gone = on_users_gone
+
+    def add_reset_listener(self, callback: Callable[[], None]):
+        """Registers a callback run when relayed frames may have been lost."""
+        self._reset_listeners.append(callback)
+
+    @property
+    def _users_key(self) -> str:
+        return f"{WORKER_USERS_PREFIX}{self.worker_id}"
+
+    async def _redis(self) -> Redis:
+        return await get_redis_messages_pool()
+
+    async def start(
+        self, on_frame: Callable[[str, Optional[int], str, Optional[str]], Awaitable[None]]
+    ):
+        redis = await self._redis()
+        self._pubsub = redis.pubsub(ignore_subscribe_messages=True)
+        await self._pubsub.subscribe(self.channel)
+        self._listener = asyncio.create_task(self._listen(on_frame))
+        await redis.set(f"{WORKER_HEARTBEAT_PREFIX}{self.worker_id}", 1, ex=HEARTBEAT_TTL)
+        await redis.sadd(WORKERS_KEY, self.worker_id)
+        self._heartbeat = asyncio.create_task(self._maintain())
+        logger.info(f"Chat bus {self.worker_id} subscribed to {self.channel}")
+
+    async def stop(self):
+        for task in (self._listener, self._heartbeat):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._listener = self._heartbeat = None
+        redis = await self._redis()
+        # Users whose only sockets were here go offline with this worker.
+        gone = await self._replace_worker_users(redis, self.worker_id)
+        if gone:
+            self._on_users_gone(gone)
+        await redis.delete(f"{WORKER_HEARTBEAT_PREFIX}{self.worker_id}")
+        if self._pubsub is not None:
+            await self._pubsub.unsubscribe(self.channel)
+            await self._pubsub.aclose()
+            self._pubsub = None
+
+    async def _listen(self, on_frame):
+        while True:
+            try:
+                message = await self._pubsub.get_message(timeout=1.0)
+                if message is None:
+                    continue
+                origin, exclude, kind, room, frame = message["data"].split(" ", 4)
+                exclude_id = int(exclude) if origin == self.worker_id and exclude != "-" else None
+                await on_frame(frame, exclude_id, kind, None if room == ALL_ROOMS else room)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Error in chat bus listener: %s", e)
+                for callback in self._reset_listeners:
+                    callback()
+                await asyncio.sleep(1)
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                redis = await self._redis()
+                heartbeat_key = f"{WORKER_HEARTBEAT_PREFIX}{self.worker_id}"
+                if not await redis.set(heartbeat_key, 1, ex=HEARTBEAT_TTL, xx=True):
+                    # We stalled long enough to be purged; put our counts back.
+                    logger.warning(f"Chat bus {self.worker_id} missed its heartbeat, restoring presence")
+                    await redis.set(heartbeat_key, 1, ex=HEARTBEAT_TTL)
+                    counts = self._local_counts()
+                    await self._replace_worker_users(redis, self.worker_id, counts)
+                await self._purge_dead_workers(redis)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Error in chat bus heartbeat: %s", e)
+
+    async def _purge_dead_workers(self, redis: Redis):
+        for worker_id in await redis.smembers(WORKERS_KEY):
+            if worker_id == self.worker_id or await redis.exists(f"{WORKER_HEARTBEAT_PREFIX}{worker_id}"):
+                continue
+            gone = await self._replace_worker_users(redis, worker_id)
+            logger.info(f"Purged presence of dead chat worker {worker_id}")
+            if gone:
+                self._on_users_gone(gone)
+
+    async def _replace_worker_users(
+        self, redis: Redis, worker_id: str, counts: Optional[Dict[str, int]] = None
+    ) -> List[str]:
+        """Purges a worker's counts, or with ``counts`` resets them to those."""
+        args = [worker_id, "0" if counts is None else "1"]
+        for username, count in (counts or {}).items():
+            args += [username, count]
+        return await run_script(
+            redis,
+            REPLACE_WORKER_USERS_SCRIPT,
+            keys=[ONLINE_USERS_KEY, f"{WORKER_USERS_PREFIX}{worker_id}", WORKERS_KEY],
+            args=args,
+        )
+
+    async def publish(
+        self, frame: str, exclude_id: Optional[int] = None, kind: str = "event", room: Optional[str] = None
+    ):
+        redis = await self._redis()
+        exclude = "-" if exclude_id is None else str(exclude_id)
+        room = ALL_ROOMS if room is None else room
+        await redis.publish(self.channel, f"{self.worker_id} {exclude} {kind} {room} {frame}")
+
+    async def user_joined(self, username: str) -> int:
+        """Counts one more socket of the user; returns their socket count."""
+        redis = await self._redis()
+        return await run_script(
+            redis, USER_JOINED_SCRIPT, keys=[ONLINE_USERS_KEY, self._users_key], args=[username]
+        )
+
+    async def user_left(self, username: str) -> int:
+        """Counts one socket less; returns how many the user still has."""
+        redis = await self._redis()
+        return await run_script(
+            redis, USER_LEFT_SCRIPT, keys=[ONLINE_USERS_KEY, self._users_key], args=[username]
+        )
+
+    async def online_users(self) -> List[str]:
+        redis = await self._redis()
+        return await redis.hkeys(ONLINE_USERS_KEY)
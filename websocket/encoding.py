@@ -0,0 +1,43 @@
+import json
+import logging
+from typing import Any
+from typing import Callable
+import settings
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+
+def _encode_stdlib(payload: Any) -> str:
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str)
+
+
+def _encode_orjson(payload: Any) -> str:
+    return orjson.dumps(payload, default=str).decode()
+
+
+def _select_encoder(name: str) -> Callable[[Any], str]:
+    if name in ("auto", "orjson") and orjson is not None:
+        return _encode_orjson
+    if name == "orjson":
+        logger.warning("orjson is not installed, falling back to the stdlib JSON encoder")
+    return _encode_stdlib
+
+
+_encoder = _select_encoder(settings.CHAT_JSON_ENCODER)
+
+
+def encode_frame(payload: Any) -> str:
+    """Serializes an outbound event once into the text frame shared by every recipient."""
+    return _encoder(payload)
+
+
+def decode_frame(data: str) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+from collections import OrderedDict
+from collections import deque
+from typing import Awaitable
+from typing import Callable
+from typing import Deque
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+from .encoding import decode_frame
+from .encoding import encode_frame
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def sanitize_message(message: dict) -> dict:
+    sanitized = {
+        "id": message["id"],
+        "username": message["username"],
+        "content": message["content"],
+        "created_at": message["created_at"],
+    }
+    # Messages saved before sequence numbers existed (or read back from
+    # Postgres, which does not store them) have none.
+    if message.get("seq") is not None:
+        sanitized["seq"] = message["seq"]
+    return sanitized
+
+
+def _entry(message: dict) -> Tuple[int, Optional[int], str]:
+    return message["id"], message.get("seq"), encode_frame(sanitize_message(message))
+
+
+def _contiguous(ring) -> bool:
+    seqs = [seq for _, seq, _ in ring if seq is not None]
+    return all(later == earlier + 1 for earlier, later in zip(seqs, seqs[1:]))
+
+
+class RecentHistory:
+    """Per-room ring buffers of the newest messages, kept pre-encoded.
+
+    Each entry is the message exactly as it appears in ``initial_load``, and
+    the assembled frame is cached until the room's next message, so a
+    connect is a dictionary lookup instead of a Redis round-trip plus a
+    decode and re-encode. A room is hydrated from ``load`` the first time it
+    is asked for; after that every chat message reaches the buffer through
+    ``add`` (the manager's local fan-out, which also carries bus traffic).
+    Only the ``max_rooms`` most recently used rooms are kept.
+
+    A message lost on the way would leave a permanent hole, so a ring that
+    received a message out of sequence is checked before its next frame is
+    built and read again from Redis if the hole is still there (bus traffic
+    of different workers may just arrive out of order). ``reset`` drops
+    every ring when the bus may have lost messages.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[str, int], Awaitable[List[dict]]],
+        size: int,
+        page_size: int,
+        max_rooms: int,
+    ):
+        self.size = size
+        self.page_size = page_size
+        self.max_rooms = max_rooms
+        self._load = load
+        self._rings: "OrderedDict[str, Deque[Tuple[int, Optional[int], str]]]" = OrderedDict()
+        self._frames: Dict[str, Tuple[str, Optional[int]]] = {}
+        self._hydrating: Dict[str, asyncio.Task] = {}
+        # Messages that arrive while their room is being read from Redis.
+        self._arrived_early: Dict[str, List[dict]] = {}
+        # Rooms that got a message out of sequence since they were hydrated.
+        self._unverified: Set[str] = set()
+        self.hits = 0
+        self.hydrations = 0
+
+    async def initial_load(self, room: str) -> Tuple[str, Optional[int]]:
+        """The room's ``initial_load`` frame and the id of its oldest message."""
+        cached = self._frames.get(room)
+        if cached is not None:
+            self.hits += 1
+            self._rings.move_to_end(room)
+            return cached
+        if room in self._unverified:
+            self._unverified.discard(room)
+            if not _contiguous(self._rings.get(room, ())):
+                logger.warning(f"Recent history of room {room} has a gap, reloading it")
+                self._drop(room)
+        if room not in self._rings:
+            await self._hydrate(room)
+        self._rings.move_to_end(room)
+        ring = self._rings[room]
+        page = list(ring)[-self.page_size:]
+        frame = (
+            '{"type":"initial_load","room":' + encode_frame(room)
+            + ',"messages":[' + ",".join(encoded for _, _, encoded in page) + "]}"
+        )
+        cached = self._frames[room] = (frame, page[0][0] if page else None)
+        return cached
+
+    async def _hydrate(self, room: str):
+        task = self._hydrating.get(room)
+        if task is None:
+            task = self._hydrating[room] = asyncio.create_task(self._load(room, self.size))
+            self._arrived_early[room] = []
+        try:
+            messages = await task
+        finally:
+            self._hydrating.pop(room, None)
+        arrived_early = self._arrived_early.pop(room, [])
+        if room in self._rings:
+            # A concurrent caller already built the ring from the same read.
+            return
+        self.hydrations += 1
+        self._rings[room] = deque((_entry(message) for message in messages), maxlen=self.size)
+        for message in arrived_early:
+            self.add(room, message)
+        while len(self._rings) > self.max_rooms:
+            evicted, _ = self._rings.popitem(last=False)
+            self._frames.pop(evicted, None)
+            self._unverified.discard(evicted)
+
+    def _drop(self, room: str):
+        self._rings.pop(room, None)
+        self._frames.pop(room, None)
+        self._unverified.discard(room)
+
+    def reset(self):
+        """Forgets every room; each is read from Redis again when next asked for."""
+        self._rings.clear()
+        self._frames.clear()
+        self._unverified.clear()
+
+    def add(self, room: str, message: dict):
+        """Records a message of a hydrated room; others load it from Redis."""
+        ring = self._rings.get(room)
+        if ring is None:
+            if room in self._arrived_early:
+                self._arrived_early[room].append(message)
+            return
+        entry = _entry(message)
+        if not ring or entry[0] > ring[-1][0]:
+            if ring and None not in (entry[1], ring[-1][1]) and entry[1] != ring[-1][1] + 1:
+                self._unverified.add(room)
+            ring.append(entry)
+        elif all(queued[0] != entry[0] for queued in ring):
+            # Bus traffic of different workers may interleave out of id order.
+            self._unverified.add(room)
+            position = next(index for index, queued in enumerate(ring) if queued[0] > entry[0])
+            if len(ring) == ring.maxlen:
+                if position == 0:
+                    return
+                ring.popleft()
+                position -= 1
+            ring.insert(position, entry)
+        else:
+            return
+        self._frames.pop(room, None)
+
+    def entries_since(self, room: str, since: int) -> Optional[List[Tuple[int, Optional[int], str]]]:
+        """``(id, seq, encoded)`` of the messages of ``room`` after sequence
+        number ``since``, or None when the buffer does not hold all of them."""
+        ring = self._rings.get(room)
+        if ring is None or not ring or ring[-1][1] is None:
+            return None
+        if since > ring[-1][1]:
+            # Ahead of the room: its counter was reset, the client must reload.
+            return None
+        if since == ring[-1][1]:
+            return []
+        missed = [entry for entry in ring if entry[1] is not None and entry[1] > since]
+        expected = range(since + 1, since + 1 + len(missed))
+        if any(entry[1] != seq for entry, seq in zip(missed, expected)):
+            return None
+        return missed
+
+    def newest_id(self, room: str) -> Optional[int]:
+        ring = self._rings.get(room)
+        return ring[-1][0] if ring else None
+
+    def add_frame(self, room: str, data: str):
+        if room in self._rings or room in self._arrived_early:
+            self.add(room, decode_frame(data))
+
+    def stats(self) -> dict:
+        return {"rooms": len(self._rings), "hits": self.hits, "hydrations": self.hydrations}
@@ -0,0 +1,107 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Deque
+from typing import Optional
+from typing import Tuple
+from fastapi import WebSocket
+from starlette.websockets import WebSocketState
+from .protocol import send_frame
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "drop_oldest"
+DROP_TYPING = "drop_typing"
+DISCONNECT = "disconnect"
+SLOW_CONSUMER_POLICIES = (DROP_OLDEST, DROP_TYPING, DISCONNECT)
+
+FRAME_EVENT = "event"
+FRAME_TYPING = "typing"
+# A chat message; queued like an event, but also recorded in recent history.
+FRAME_MESSAGE = "message"
+
+SLOW_CONSUMER_CLOSE_CODE = 4008
+
+
+class Outbox:
+    """Bounded outbound queue of one socket, drained by its own writer task.
+
+    Producers only enqueue, so a broadcast never waits on a slow client.
+    When the queue is full the configured policy decides what gives way.
+    """
+
+    def __init__(self, websocket: WebSocket, maxsize: int, policy: str):
+        if policy not in SLOW_CONSUMER_POLICIES:
+            raise ValueError(f"Unknown slow consumer policy: {policy}")
+        self.websocket = websocket
+        self.maxsize = maxsize
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+        self._frames: Deque[Tuple[str, str]] = deque()
+        self._ready = asyncio.Event()
+        self._writer = asyncio.create_task(self._write_loop())
+        self._evict_task: Optional[asyncio.Task] = None
+
+    def put(self, data: str, kind: str = FRAME_EVENT):
+        if self.closed:
+            return
+        if len(self._frames) >= self.maxsize and not self._make_room(kind):
+            return
+        self._frames.append((data, kind))
+        self._ready.set()
+
+    def _make_room(self, kind: str) -> bool:
+        """Applies the overflow policy. Returns False if the new frame is dropped."""
+        self.dropped += 1
+        if self.policy == DISCONNECT:
+            self._evict()
+            return False
+        if self.policy == DROP_TYPING:
+            if kind == FRAME_TYPING:
+                return False
+            for queued in self._frames:
+                if queued[1] == FRAME_TYPING:
+                    self._frames.remove(queued)
+                    return True
+        self._frames.popleft()
+        return True
+
+    def _evict(self):
+        logger.info(f"Evicting slow consumer {self.websocket.client}")
+        self.closed = True
+        self._frames.clear()
+        self._writer.cancel()
+        self._evict_task = asyncio.create_task(self._close_socket())
+
+    async def _close_socket(self):
+        if self.websocket.application_state != WebSocketState.DISCONNECTED:
+            try:
+                await self.websocket.close(code=SLOW_CONSUMER_CLOSE_CODE, reason="Slow consumer")
+            except Exception as e:
+                logger.info(f"Error closing slow consumer: {e}")
+
+    async def _write_loop(self):
+        try:
+            while True:
+                await self._ready.wait()
+                while self._frames:
+                    data, _ = self._frames.popleft()
+                    await send_frame(self.websocket, data)
+                self._ready.clear()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The peer went away; the receive loop of its handler cleans up.
+            logger.info(f"Stopped writer for {self.websocket.client}: {e}")
+            self.closed = True
+            self._frames.clear()
+
+    async def close(self):
+        self.closed = True
+        self._writer.cancel()
+        try:
+            await self._writer
+        except (asyncio.CancelledError, Exception):
+            pass
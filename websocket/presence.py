@@ -0,0 +1,115 @@
+import asyncio
+import logging
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+from .bus import ChatBus
+from .encoding import encode_frame
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class Presence:
+    """Reference-counted set of online users that broadcasts only changes.
+
+    A user is online while at least one of their sockets is connected, so
+    extra tabs neither duplicate them nor announce anything. Transitions
+    are collected for ``debounce`` seconds and sent as one
+    ``{"type": "presence", "joined": [...], "left": [...]}`` frame, which
+    turns a reconnect storm into a handful of broadcasts. Only a user's
+    latest transition in a window is sent, so clients can apply deltas as
+    plain set operations on top of the ``users_list`` snapshot they get
+    on connect.
+    """
+
+    def __init__(
+        self,
+        publish: Callable[[str], Awaitable[None]],
+        debounce: float,
+        bus: Optional[ChatBus] = None,
+    ):
+        self.debounce = debounce
+        self.bus = bus
+        self._publish = publish
+        self._counts: Dict[str, int] = {}
+        self._pending: Dict[str, bool] = {}
+        self._flusher: Optional[asyncio.Task] = None
+        if bus is not None:
+            bus.watch_presence(lambda: dict(self._counts), self._users_gone)
+
+    async def join(self, username: str):
+        self._counts[username] = self._counts.get(username, 0) + 1
+        if self.bus is not None:
+            # The Redis count spans every worker; only the first socket joins.
+            first = await self.bus.user_joined(username) == 1
+        else:
+            first = self._counts[username] == 1
+        if first:
+            self._changed(username, online=True)
+
+    async def leave(self, username: str):
+        count = self._counts.get(username, 0) - 1
+        if count > 0:
+            self._counts[username] = count
+        else:
+            self._counts.pop(username, None)
+        if self.bus is not None:
+            last = await self.bus.user_left(username) == 0
+        else:
+            last = count <= 0
+        if last:
+            self._changed(username, online=False)
+
+    def _users_gone(self, usernames: List[str]):
+        # Users whose only sockets were on a worker that died, or on this
+        # one as it stops. A concurrent join here still wins: it records
+        # its own transition after this one.
+        for username in usernames:
+            self._changed(username, online=False)
+
+    async def online_users(self) -> List[str]:
+        if self.bus is not None:
+            return await self.bus.online_users()
+        return list(self._counts)
+
+    async def snapshot_frame(self) -> str:
+        return encode_frame({"type": "users_list", "users": await self.online_users()})
+
+    def _changed(self, username: str, online: bool):
+        self._pending[username] = online
+        if self._flusher is None:
+            self._flusher = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        try:
+            await asyncio.sleep(self.debounce)
+        finally:
+            self._flusher = None
+        await self.flush()
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        frame = encode_frame({
+            "type": "presence",
+            "joined": [username for username, online in pending.items() if online],
+            "left": [username for username, online in pending.items() if not online],
+        })
+        try:
+            await self._publish(frame)
+        except Exception as e:
+            logger.error(f"Error publishing presence update: {e}")
+
+    async def stop(self):
+        """Sends the changes still waiting for the debounce right away."""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {"local_users": len(self._counts), "pending_changes": len(self._pending)}
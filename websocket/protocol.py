@@ -0,0 +1,78 @@
+import logging
+from functools import lru_cache
+from typing import Any
+from typing import Optional
+from fastapi import WebSocket
+from fastapi import WebSocketDisconnect
+from .encoding import decode_frame
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack is optional
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+# Sec-WebSocket-Protocol values, in the server's order of preference.
+SUBPROTOCOLS = {"chat.msgpack": MSGPACK, "chat.json": JSON}
+
+
+def _available(protocol: str) -> bool:
+    return protocol == JSON or (protocol == MSGPACK and msgpack is not None)
+
+
+def negotiate(websocket: WebSocket) -> Optional[str]:
+    """Picks the wire protocol of a socket about to be accepted.
+
+    A client either offers subprotocols (``chat.msgpack``, ``chat.json``)
+    or passes ``?protocol=msgpack``; anything else, or MessagePack without
+    the ``msgpack`` package, gets JSON text frames. Returns the subprotocol
+    to pass to ``accept``. permessage-deflate is negotiated separately by
+    the server (``WS_PER_MESSAGE_DEFLATE``) and applies to either protocol.
+    """
+    offered = websocket.scope.get("subprotocols") or []
+    for subprotocol, protocol in SUBPROTOCOLS.items():
+        if subprotocol in offered and _available(protocol):
+            websocket.state.wire_protocol = protocol
+            return subprotocol
+    requested = websocket.query_params.get("protocol", JSON)
+    websocket.state.wire_protocol = requested if _available(requested) else JSON
+    return None
+
+
+def wire_protocol(websocket: WebSocket) -> str:
+    return getattr(websocket.state, "wire_protocol", JSON)
+
+
+@lru_cache(maxsize=256)
+def _to_msgpack(data: str) -> bytes:
+    # Outbound frames are encoded once as JSON and the same string is queued
+    # for every recipient, so the cache converts each frame only once.
+    return msgpack.packb(decode_frame(data))
+
+
+async def send_frame(websocket: WebSocket, data: str):
+    """Sends an encoded JSON frame in the socket's wire protocol."""
+    if wire_protocol(websocket) == MSGPACK:
+        await websocket.send_bytes(_to_msgpack(data))
+    else:
+        await websocket.send_text(data)
+
+
+async def receive_message(websocket: WebSocket) -> dict:
+    """The next text or binary ASGI message; raises on disconnect."""
+    message = await websocket.receive()
+    if message["type"] == "websocket.disconnect":
+        raise WebSocketDisconnect(message.get("code", 1000), message.get("reason"))
+    return message
+
+
+async def receive_frame(websocket: WebSocket) -> Any:
+    """The next inbound event, decoded. Text frames are always JSON."""
+    message = await receive_message(websocket)
+    if message.get("bytes") is not None and wire_protocol(websocket) == MSGPACK:
+        return msgpack.unpackb(message["bytes"])
+    return decode_frame(message.get("text") or message.get("bytes"))
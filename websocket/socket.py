@@ -1,24 +1,59 @@
-import json
 import logging
+import re
+import time
+import settings
 from dataclasses import dataclass
 from dataclasses import field
 from datetime import datetime
 from uuid import UUID
 from fastapi import WebSocket
 from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
 from redis.asyncio import Redis
-from sqlalchemy.future import select
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import update
 from starlette.websockets import WebSocketState
 
 from api.message.actions import get_messages
+from api.message.actions import get_messages_since
 from api.message.actions import save_message
+from api.message.writer import MessageBacklogFull
 from db.models import ConnectionHistory
+from db.models import DEFAULT_ROOM
+from db.redis import get_redis_messages_pool
+from db.session import async_session
+from metrics import CHAT_CONNECTIONS
+from metrics import CHAT_FAN_OUT_LATENCY
+from metrics import CHAT_FRAMES_QUEUED
+from metrics import CHAT_MESSAGES_SENT
+from .bus import ChatBus
+from .encoding import decode_frame
+from .encoding import encode_frame
+from .history import RecentHistory
+from .history import sanitize_message
+from .outbox import FRAME_EVENT
+from .outbox import FRAME_MESSAGE
+from .outbox import FRAME_TYPING
+from .outbox import Outbox
+from .presence import Presence
+from .protocol import negotiate
+from .typing_tracker import TypingTracker
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+HISTORY_PAGE_SIZE = 20
+ROOM_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def valid_room(room) -> bool:
+    """Room ids go into Redis keys and bus headers, so no spaces or colons."""
+    return isinstance(room, str) and ROOM_NAME_PATTERN.match(room) is not None
+
+
 @dataclass
 class User:
     user_id: UUID
@@ -28,84 +63,375 @@ class User:
 @dataclass
 class ConnectionManager:
     active_connections: Dict[WebSocket, User] = field(default_factory=dict)
-    last_message_index: Dict[WebSocket, int] = field(default_factory=dict)
+    # Per socket, per joined room: id of the oldest message it has received.
+    history_cursor: Dict[WebSocket, Dict[str, Optional[int]]] = field(default_factory=dict)
+    outboxes: Dict[WebSocket, Outbox] = field(default_factory=dict)
+    history_rows: Dict[WebSocket, int] = field(default_factory=dict)
+    rooms: Dict[str, Set[WebSocket]] = field(default_factory=dict)
+    memberships: Dict[WebSocket, Set[str]] = field(default_factory=dict)
+    # Live frames held back per (socket, room) while its history is read.
+    catching_up: Dict[Tuple[WebSocket, str], List[Tuple[str, str]]] = field(default_factory=dict)
+    bus: Optional[ChatBus] = None
+    send_queue_size: int = settings.CHAT_SEND_QUEUE_SIZE
+    slow_consumer_policy: str = settings.CHAT_SLOW_CONSUMER_POLICY
+    max_rooms_per_socket: int = settings.CHAT_MAX_ROOMS_PER_SOCKET
+    presence: Presence = field(init=False)
+    typing: Dict[str, TypingTracker] = field(init=False)
+    history: RecentHistory = field(init=False)
+
+    def __post_init__(self):
+        self.presence = Presence(
+            self._fan_out, settings.CHAT_PRESENCE_DEBOUNCE_MS / 1000, self.bus
+        )
+        self.typing = {}
+        self.history = RecentHistory(
+            self._load_recent_messages,
+            size=max(settings.CHAT_RECENT_HISTORY_SIZE, HISTORY_PAGE_SIZE),
+            page_size=HISTORY_PAGE_SIZE,
+            max_rooms=settings.CHAT_RECENT_HISTORY_ROOMS,
+        )
+        if self.bus is not None:
+            self.bus.add_reset_listener(self.history.reset)
+
+    async def _load_recent_messages(self, room: str, count: int) -> List[dict]:
+        redis = await get_redis_messages_pool()
+        return await get_messages(redis, count=count, room=room)
+
+    async def start(self):
+        if self.bus is not None:
+            await self.bus.start(self._send_local)
+        await self.history.initial_load(DEFAULT_ROOM)
+
+    async def stop(self):
+        for tracker in self.typing.values():
+            await tracker.stop_all()
+        if self.bus is not None:
+            await self.bus.stop()
+        # After the bus, which reports the users that left with this worker;
+        # publishing needs only the Redis pool, not the bus listener.
+        await self.presence.stop()
+        for outbox in list(self.outboxes.values()):
+            await outbox.close()
+
+    async def _fan_out(
+        self,
+        data: str,
+        sender_websocket: Optional[WebSocket] = None,
+        kind: str = FRAME_EVENT,
+        room: Optional[str] = None,
+    ):
+        """Delivers a frame to the members of ``room`` (every chat socket when
+        it is None), on all workers when a bus is set."""
+        exclude_id = id(sender_websocket) if sender_websocket is not None else None
+        if self.bus is not None:
+            await self.bus.publish(data, exclude_id, kind, room)
+        else:
+            await self._send_local(data, exclude_id, kind, room)
+
+    async def _send_local(
+        self,
+        data: str,
+        exclude_id: Optional[int] = None,
+        kind: str = FRAME_EVENT,
+        room: Optional[str] = None,
+    ):
+        started = time.perf_counter()
+        queued = 0
+        if kind == FRAME_MESSAGE and room is not None:
+            self.history.add_frame(room, data)
+        targets = self.outboxes if room is None else self.rooms.get(room, ())
+        for connection in list(targets):
+            outbox = self.outboxes.get(connection)
+            if (
+                outbox is not None
+                and id(connection) != exclude_id
+                and connection.client_state == WebSocketState.CONNECTED
+            ):
+                held_back = self.catching_up.get((connection, room)) if room is not None else None
+                if held_back is not None:
+                    held_back.append((data, kind))
+                else:
+                    outbox.put(data, kind)
+                queued += 1
+        # One observation per fan-out rather than per socket.
+        CHAT_FAN_OUT_LATENCY.labels(kind).observe(time.perf_counter() - started)
+        CHAT_FRAMES_QUEUED.labels(kind).inc(queued)
+
+    def send_to(self, websocket: WebSocket, data: str):
+        """Queues a frame for a single socket behind whatever it already has pending."""
+        outbox = self.outboxes.get(websocket)
+        if outbox is not None:
+            outbox.put(data)
+
+    def send_error(self, websocket: WebSocket, detail: str):
+        self.send_to(websocket, encode_frame({"type": "error", "detail": detail}))
+
+    def in_room(self, websocket: WebSocket, room: str) -> bool:
+        return room in self.memberships.get(websocket, ())
+
+    def _add_member(self, websocket: WebSocket, room: str, cursor: Optional[int]):
+        self.rooms.setdefault(room, set()).add(websocket)
+        self.memberships.setdefault(websocket, set()).add(room)
+        self.history_cursor.setdefault(websocket, {})[room] = cursor
+
+    def _remove_member(self, websocket: WebSocket, room: str):
+        members = self.rooms.get(room)
+        if members is not None:
+            members.discard(websocket)
+            if not members:
+                del self.rooms[room]
+        self.memberships.get(websocket, set()).discard(room)
+        self.history_cursor.get(websocket, {}).pop(room, None)
+        self.catching_up.pop((websocket, room), None)
+        self._drop_idle_tracker(room)
+
+    def _drop_idle_tracker(self, room: str):
+        tracker = self.typing.get(room)
+        if tracker is not None and room not in self.rooms and tracker.idle:
+            del self.typing[room]
+
+    def _typing_tracker(self, room: str) -> TypingTracker:
+        tracker = self.typing.get(room)
+        if tracker is None:
+            async def publish(data: str):
+                await self._fan_out(data, kind=FRAME_TYPING, room=room)
+
+            tracker = self.typing[room] = TypingTracker(
+                publish,
+                settings.CHAT_TYPING_TTL_MS / 1000,
+                settings.CHAT_TYPING_FLUSH_MS / 1000,
+                room=room,
+                on_idle=lambda: self._drop_idle_tracker(room),
+            )
+        return tracker
+
+    async def _room_frames(
+        self, room: str, redis_pool_messages: Redis, since: Optional[int] = None
+    ) -> Tuple[List[str], Optional[int], Tuple[str, int]]:
+        """Frames that bring a socket up to date with ``room``, its history
+        cursor, and the last message they cover as ``(field, value)`` with
+        field "id" or "seq".
+
+        Without ``since`` that is the ``initial_load``. With it, the client
+        already holds the room up to that sequence number and gets only the
+        messages after it, from the recent-history buffer or else the Redis
+        window, as ``missed_messages``. When the gap is too large or already
+        trimmed, ``resync_required`` tells it to drop its copy and an
+        ``initial_load`` follows. The cursor is the oldest message sent, or
+        of the initial page when nothing was missed.
+        """
+        initial_load, cursor = await self.history.initial_load(room)
+        newest = ("id", self.history.newest_id(room) or 0)
+        if since is None:
+            return [initial_load], cursor, newest
+        entries = self.history.entries_since(room, since)
+        if entries is not None:
+            encoded = [entry[2] for entry in entries]
+            oldest_id = entries[0][0] if entries else None
+        else:
+            messages = await get_messages_since(
+                redis_pool_messages, room, since, settings.CHAT_RESUME_MAX_MESSAGES
+            )
+            if messages is None:
+                resync = encode_frame({"type": "resync_required", "room": room, "since": since})
+                return [resync, initial_load], cursor, newest
+            encoded = [encode_frame(sanitize_message(message)) for message in messages]
+            oldest_id = messages[0]["id"] if messages else None
+        missed = (
+            '{"type":"missed_messages","room":' + encode_frame(room) + ',"since":' + str(since)
+            + ',"messages":[' + ",".join(encoded) + "]}"
+        )
+        return [missed], oldest_id or cursor, ("seq", since + len(encoded))
+
+    async def _catch_up(
+        self,
+        websocket: WebSocket,
+        room: str,
+        redis_pool_messages: Redis,
+        since: Optional[int] = None,
+    ):
+        """Adds the socket to ``room`` and queues the room's history for it.
+
+        Membership starts before the history is read, so nothing fanned out
+        meanwhile is lost: the room's live frames are held back until the
+        history is queued, and messages it already covers are dropped.
+        """
+        key = (websocket, room)
+        held_back = self.catching_up[key] = []
+        self._add_member(websocket, room, None)
+        try:
+            frames, cursor, (field_name, last) = await self._room_frames(room, redis_pool_messages, since)
+        except Exception:
+            if self.catching_up.get(key) is held_back:
+                self._remove_member(websocket, room)
+            raise
+        if self.catching_up.get(key) is not held_back:
+            # The socket left the room or disconnected in the meantime.
+            return
+        del self.catching_up[key]
+        self.history_cursor[websocket][room] = cursor
+        outbox = self.outboxes[websocket]
+        for frame in frames:
+            outbox.put(frame)
+        for data, kind in held_back:
+            if kind == FRAME_MESSAGE and decode_frame(data).get(field_name, 0) <= last:
+                continue
+            outbox.put(data, kind)
 
     async def connect(
         self,
         websocket: WebSocket,
         user: User,
-        db: AsyncSession,
         redis_pool_messages: Redis,
+        since: Optional[int] = None,
     ):
-        await websocket.accept()
-        self.active_connections[websocket] = user
-        self.last_message_index[websocket] = -20
-
-        initial_messages = await get_messages(redis_pool_messages, start=-20, count=20)
-        sanitized_messages = [
-            {
-                "id": message["id"],
-                "username": message["username"],
-                "content": message["content"],
-                "created_at": message["created_at"]
-            }
-            for message in initial_messages
-        ]
-        await websocket.send_text(
-            json.dumps({"type": "initial_load", "messages": sanitized_messages})
+        """Accepts the socket into the default room. ``since`` is the last
+        sequence number of that room the client saw before reconnecting."""
+        await websocket.accept(subprotocol=negotiate(websocket))
+
+        outbox = self.outboxes[websocket] = Outbox(
+            websocket, self.send_queue_size, self.slow_consumer_policy
         )
+        try:
+            await self._catch_up(websocket, DEFAULT_ROOM, redis_pool_messages, since)
+        except Exception:
+            self.outboxes.pop(websocket, None)
+            self.memberships.pop(websocket, None)
+            self.history_cursor.pop(websocket, None)
+            await outbox.close()
+            raise
+        self.active_connections[websocket] = user
+        CHAT_CONNECTIONS.inc()
 
-        new_connection = ConnectionHistory(user_id=user.user_id)
-        db.add(new_connection)
-        await db.commit()
-        await self.send_active_users()
+        # Sockets live for hours; hold a pooled connection only for the insert.
+        async with async_session() as db:
+            new_connection = ConnectionHistory(user_id=user.user_id)
+            db.add(new_connection)
+            await db.commit()
+        self.history_rows[websocket] = new_connection.id
+        await self.presence.join(user.username)
+        await self.send_active_users(websocket)
 
-    async def send_active_users(self):
-        active_users = [user.username for user in self.active_connections.values()]
-        users_list = json.dumps({"type": "users_list", "users": active_users})
-        for websocket in self.active_connections:
-            if not websocket.client_state == WebSocketState.DISCONNECTED:
-                await websocket.send_text(users_list)
+    async def join_room(
+        self,
+        websocket: WebSocket,
+        room: str,
+        redis_pool_messages: Redis,
+        since: Optional[int] = None,
+    ):
+        """Adds the socket to ``room`` and sends it the room's ``initial_load``,
+        or only what it missed after sequence number ``since``."""
+        if websocket not in self.outboxes or self.in_room(websocket, room):
+            return
+        if len(self.memberships.get(websocket, ())) >= self.max_rooms_per_socket:
+            self.send_error(websocket, f"Нельзя находиться больше чем в {self.max_rooms_per_socket} комнатах.")
+            return
+        await self._catch_up(websocket, room, redis_pool_messages, since)
+
+    def leave_room(self, websocket: WebSocket, room: str):
+        if not self.in_room(websocket, room):
+            return
+        user = self.active_connections.get(websocket)
+        if user is not None:
+            self.broadcast_stop_typing(user.username, websocket, room)
+        self._remove_member(websocket, room)
+        self.send_to(websocket, encode_frame({"type": "left_room", "room": room}))
 
-    async def disconnect(self, websocket: WebSocket, db: AsyncSession):
+    async def load_more_messages(
+        self,
+        websocket: WebSocket,
+        redis_pool_messages: Redis,
+        before_id: Optional[int] = None,
+        room: str = DEFAULT_ROOM,
+    ):
+        """Sends the page of ``room`` preceding ``before_id``, or the oldest
+        message of the room the socket has received so far, and moves its
+        cursor back."""
+        if not self.in_room(websocket, room):
+            return
+        cursors = self.history_cursor[websocket]
+        if before_id is None:
+            before_id = cursors.get(room)
+        messages = []
+        if before_id is not None:
+            messages = await get_messages(redis_pool_messages, before_id, HISTORY_PAGE_SIZE, room)
+        if messages and room in cursors:
+            cursors[room] = messages[0]["id"]
+        self.send_to(websocket, encode_frame({
+            "type": "more_messages",
+            "room": room,
+            "messages": [sanitize_message(message) for message in messages],
+            "has_more": len(messages) == HISTORY_PAGE_SIZE,
+        }))
+
+    async def send_active_users(self, websocket: WebSocket):
+        """Sends the full online list to one socket; everyone else only
+        gets presence deltas."""
+        self.send_to(websocket, await self.presence.snapshot_frame())
+
+    async def disconnect(self, websocket: WebSocket):
         user = self.active_connections.pop(websocket, None)
-        self.last_message_index.pop(websocket, None)
+        for room in list(self.memberships.get(websocket, ())):
+            if user:
+                self.broadcast_stop_typing(user.username, websocket, room)
+            self._remove_member(websocket, room)
+        self.memberships.pop(websocket, None)
+        self.history_cursor.pop(websocket, None)
+        history_row = self.history_rows.pop(websocket, None)
+        outbox = self.outboxes.pop(websocket, None)
+        if outbox is not None:
+            await outbox.close()
         if user:
-            last_connection = await db.execute(
-                select(ConnectionHistory)
-                .filter_by(user_id=user.user_id, disconnected_at=None)
-                .order_by(ConnectionHistory.connected_at.desc())
-                .limit(1)
-            )
-            last_connection = last_connection.scalars().first()
-            if last_connection:
-                last_connection.disconnected_at = datetime.now()
-        await db.commit()
-        await self.send_active_users()
+            CHAT_CONNECTIONS.dec()
+            await self.presence.leave(user.username)
+        if history_row is not None:
+            async with async_session() as db:
+                await db.execute(
+                    update(ConnectionHistory)
+                    .where(ConnectionHistory.id == history_row)
+                    .values(disconnected_at=datetime.now())
+                )
+                await db.commit()
 
     async def send_personal_message(
         self,
         message: str,
         websocket: WebSocket,
-        db: AsyncSession,
         redis_pool_messages: Redis,
-    ):
+        room: str = DEFAULT_ROOM,
+    ) -> Optional[dict]:
+        """Saves the message and acknowledges it to the sender; returns the
+        saved message, or None when the socket is not in ``room`` or the
+        message can not be stored right now."""
+        if not self.in_room(websocket, room):
+            self.send_error(websocket, "Вы не находитесь в этой комнате.")
+            return None
         user = self.active_connections[websocket]
+        try:
+            saved_message = await save_message(
+                user_id=str(user.user_id),
+                username=user.username,
+                content=message,
+                redis_pool_messages=redis_pool_messages,
+                room=room,
+            )
+        except MessageBacklogFull as e:
+            logger.error(f"Rejected a message from {user.username}: {e}")
+            self.send_error(websocket, "Сообщения временно не сохраняются, попробуйте позже.")
+            return None
+        CHAT_MESSAGES_SENT.inc()
         message_data = {
+            "id": saved_message["id"],
+            "seq": saved_message["seq"],
+            "room": room,
             "username": user.username,
             "content": message,
-            "created_at": datetime.now().isoformat(),
+            "created_at": saved_message["created_at"],
             "type": "new_message",
         }
         logger.info(f"Sending message: {message_data}")
-        await websocket.send_text(json.dumps(message_data, ensure_ascii=False))
-        await save_message(
-            user_id=str(user.user_id),
-            username=user.username,
-            content=message,
-            db=db,
-            redis_pool_messages=redis_pool_messages,
-        )
+        self.send_to(websocket, encode_frame(message_data))
+        return saved_message
 
     async def broadcast_message(
         self,
@@ -113,27 +439,41 @@ class ConnectionManager:
         username: str,
         sender_websocket: WebSocket,
         system_message: bool = False,
+        room: str = DEFAULT_ROOM,
+        saved_message: Optional[dict] = None,
     ):
+        """Fans a message out to the room. ``saved_message`` (from
+        ``send_personal_message``) adds the id and stored timestamp and
+        records the message in every worker's recent history."""
         message_type = "system_message" if system_message else "broadcast_message"
         message_data = {
+            "room": room,
             "username": "system" if system_message else username,
             "content": message,
             "created_at": datetime.now().isoformat(),
             "type": message_type,
         }
+        kind = FRAME_EVENT
+        if saved_message is not None:
+            message_data["id"] = saved_message["id"]
+            message_data["seq"] = saved_message["seq"]
+            message_data["created_at"] = saved_message["created_at"]
+            kind = FRAME_MESSAGE
         logger.info(f"Broadcasting message: {message_data}")
-        for connection in self.active_connections:
-            if connection != sender_websocket:
-                await connection.send_text(json.dumps(message_data, ensure_ascii=False))
-
-    async def broadcast_typing(self, username: str, sender_websocket: WebSocket):
-        typing_data = json.dumps({"type": "typing", "username": username})
-        for connection in self.active_connections:
-            if connection != sender_websocket and connection.client_state == WebSocketState.CONNECTED:
-                await connection.send_text(typing_data)
-
-    async def broadcast_stop_typing(self, username: str, sender_websocket: WebSocket):
-        stop_typing_data = json.dumps({"type": "stop_typing", "username": username})
-        for connection in self.active_connections:
-            if connection != sender_websocket and connection.client_state == WebSocketState.CONNECTED:
-                await connection.send_text(stop_typing_data)
+        await self._fan_out(encode_frame(message_data), sender_websocket, kind, room)
+
+    def broadcast_typing(self, username: str, websocket: WebSocket, room: str = DEFAULT_ROOM):
+        self._typing_tracker(room).typing(username, id(websocket))
+
+    def broadcast_stop_typing(self, username: str, websocket: WebSocket, room: str = DEFAULT_ROOM):
+        tracker = self.typing.get(room)
+        if tracker is not None:
+            tracker.stop(username, id(websocket))
+
+    def stats(self) -> dict:
+        return {
+            "sockets": len(self.outboxes),
+            "rooms": len(self.rooms),
+            "typing": sum(tracker.stats()["typing"] for tracker in self.typing.values()),
+            "recent_history": self.history.stats(),
+        }
@@ -0,0 +1,128 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import Optional
+from .encoding import encode_frame
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class TypingTracker:
+    """Who is typing in a room, broadcast as batched state changes.
+
+    Keystroke-level ``typing`` events only refresh a user's expiry; a
+    broadcast happens when a user starts or stops typing. Changes are
+    collected for ``interval`` seconds and sent as one
+    ``{"type": "typing_users", "started": [...], "stopped": [...]}`` frame,
+    so each user causes at most one change per interval however fast their
+    client sends. A user who goes silent for ``ttl`` seconds, disconnects
+    or sends a message stops typing without any explicit ``stop_typing``.
+
+    Typing is tracked per connection (any hashable id of the socket), and
+    a user stops typing only when none of their tabs is. A frame can carry
+    several users, so it goes to the whole room, typers included; clients
+    leave out their own username.
+    """
+
+    def __init__(
+        self,
+        publish: Callable[[str], Awaitable[None]],
+        ttl: float,
+        interval: float,
+        room: Optional[str] = None,
+        on_idle: Optional[Callable[[], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.ttl = ttl
+        self.interval = interval
+        self.room = room
+        self._on_idle = on_idle
+        self._publish = publish
+        self._clock = clock
+        # Per typing user, the expiry of each of their typing connections.
+        self._expires_at: Dict[str, Dict[Hashable, float]] = {}
+        self._pending: Dict[str, bool] = {}
+        self._ticker: Optional[asyncio.Task] = None
+
+    def typing(self, username: str, connection: Hashable):
+        started = username not in self._expires_at
+        self._expires_at.setdefault(username, {})[connection] = self._clock() + self.ttl
+        if started:
+            self._changed(username, typing=True)
+        else:
+            self._ensure_ticker()
+
+    def stop(self, username: str, connection: Hashable):
+        connections = self._expires_at.get(username)
+        if connections is None or connections.pop(connection, None) is None:
+            return
+        if not connections:
+            del self._expires_at[username]
+            self._changed(username, typing=False)
+
+    def _changed(self, username: str, typing: bool):
+        self._pending[username] = typing
+        self._ensure_ticker()
+
+    def _ensure_ticker(self):
+        if self._ticker is None:
+            self._ticker = asyncio.create_task(self._tick())
+
+    async def _tick(self):
+        # Runs only while someone is typing or a change is unsent.
+        try:
+            while self._expires_at or self._pending:
+                await asyncio.sleep(self.interval)
+                self._expire()
+                await self.flush()
+        finally:
+            self._ticker = None
+        if self._on_idle is not None and self.idle:
+            self._on_idle()
+
+    def _expire(self):
+        now = self._clock()
+        for username, connections in list(self._expires_at.items()):
+            for connection, expires_at in list(connections.items()):
+                if expires_at <= now:
+                    del connections[connection]
+            if not connections:
+                del self._expires_at[username]
+                self._pending[username] = False
+
+    async def flush(self):
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        frame = encode_frame({
+            "type": "typing_users",
+            "room": self.room,
+            "started": [username for username, typing in pending.items() if typing],
+            "stopped": [username for username, typing in pending.items() if not typing],
+        })
+        try:
+            await self._publish(frame)
+        except Exception as e:
+            logger.error(f"Error publishing typing update: {e}")
+
+    async def stop_all(self):
+        """Stops everyone who is typing and sends the unsent changes."""
+        if self._ticker is not None:
+            self._ticker.cancel()
+            self._ticker = None
+        for username in self._expires_at:
+            self._pending[username] = False
+        self._expires_at.clear()
+        await self.flush()
+
+    @property
+    def idle(self) -> bool:
+        return not self._expires_at and not self._pending
+
+    def stats(self) -> dict:
+        return {"typing": len(self._expires_at), "pending_changes": len(self._pending)}